@@ -0,0 +1,64 @@
+"""Koji client config file handling for osg-build.
+
+Kept separate from kojiinter so that reading the config does not require
+importing the koji library (which is slow to import).
+"""
+import configparser
+import functools
+from typing import Optional
+
+from .constants import KOJI_USER_CONFIG_DIR, OSG_KOJI_USER_CONFIG_DIR
+from . import utils
+from .error import KojiError
+
+@functools.lru_cache()
+def get_koji_config_file():
+    # type: () -> str
+    """Return the path to the koji config file; raise KojiError if no such file exists."""
+    config_file = (utils.find_file("config", [OSG_KOJI_USER_CONFIG_DIR,
+                                              KOJI_USER_CONFIG_DIR]))
+    if not config_file:
+        raise KojiError("Can't find Koji config file")
+    return config_file
+
+
+@functools.lru_cache()
+def get_koji_config(config_file=None):
+    # type: (Optional[str]) -> configparser.ConfigParser
+    """Parse and return a koji config file, validating that it has some of the
+    necessary properties (e.g., a 'koji' section).
+
+    config_file: a path to the koji config file or None (in which case the default path will be used)
+
+    """
+    config = configparser.ConfigParser()
+    if not config_file:
+        config_file = get_koji_config_file()
+    config.read(config_file)
+    _validate_koji_config(config, config_file)
+    return config
+
+
+def get_koji_config_from_string(config_text, config_file="<string>"):
+    # type: (str, str) -> configparser.ConfigParser
+    """Parse and return the contents of a koji config file that the caller
+    has already read, validating it the same way as get_koji_config().
+    The result is not cached.
+
+    config_file: the path the contents were read from (used in error messages)
+
+    """
+    config = configparser.ConfigParser()
+    config.read_string(config_text, source=config_file)
+    _validate_koji_config(config, config_file)
+    return config
+
+
+def _validate_koji_config(config, config_file):
+    # type: (configparser.ConfigParser, str) -> None
+    """Raise KojiError if the parsed koji config is missing something we need"""
+    if not config.has_section("koji"):
+        raise KojiError("Koji config file %s is missing a 'koji' section" % config_file)
+    for opt in "server", "weburl", "topurl":  # TODO: "authtype" should also be required once we move to kerberos
+        if not config.has_option("koji", opt):
+            raise KojiError("Koji config file %s is missing the '%s' option" % (config_file, opt))
@@ -12,16 +12,22 @@ import sys
 import time
 import urllib
 import urllib.request, urllib.error
-from typing import Optional, List, NamedTuple, Set, Dict
+from typing import List, NamedTuple, Set, Dict
 
 from .constants import *
 from . import clientcert, constants
 from . import utils
 from .error import KojiError, type_of_error
+from .koji_config import get_koji_config
 from .utils import split_nvr
 
 log = logging.getLogger(__name__)
 
+# Number of calls to send to the hub per multicall request
+MULTICALL_BATCH_SIZE = 100
+# Same for listTagged calls on whole tags; some tags have tens of thousands of builds
+LIST_TAGGED_BATCH_SIZE = 4
+
 HAVE_KOJILIB = None
 try:
     import koji as kojilib
@@ -30,51 +36,6 @@ try:
 except (ImportError, AttributeError):
     HAVE_KOJILIB = False
 
-# TODO: replace with @functools.lru_cache() once we drop Python 2
-
-__koji_config_file = None
-__koji_config = None
-
-
-def get_koji_config_file():
-    # type: () -> str
-    """Return the path to the koji config file; raise KojiError if no such file exists."""
-    global __koji_config_file
-
-    if not __koji_config_file:
-        config_file = (utils.find_file("config", [OSG_KOJI_USER_CONFIG_DIR,
-                                                  KOJI_USER_CONFIG_DIR]))
-        if not config_file:
-            raise KojiError("Can't find Koji config file")
-        __koji_config_file = config_file
-
-    return __koji_config_file
-
-
-def get_koji_config(config_file=None):
-    # type: (Optional[str]) -> configparser.ConfigParser
-    """Parse and return a koji config file, validating that it has some of the
-    necessary properties (e.g., a 'koji' section).
-
-    config_file: a path to the koji config file or None (in which case the default path will be used)
-
-    """
-    global __koji_config
-
-    if not __koji_config:
-        config = configparser.ConfigParser()
-        if not config_file:
-            config_file = get_koji_config_file()
-        config.read(config_file)
-        if not config.has_section("koji"):
-            raise KojiError("Koji config file %s is missing a 'koji' section" % config_file)
-        for opt in "server", "weburl", "topurl":  # TODO: "authtype" should also be required once we move to kerberos
-            if not config.has_option("koji", opt):
-                raise KojiError("Koji config file %s is missing the '%s' option" % (config_file, opt))
-        __koji_config = config
-
-    return __koji_config
-
 
 def get_koji_cmd():
     """Get the command used to call koji."""
@@ -109,6 +70,9 @@ def download_koji_file(task_id, filename, destdir):
         desthandle.write(handle.read())
 
 
+_EL_SUFFIX_RE = re.compile(r"([.]el\d+)+$")
+
+
 def chop_package_el_suffix(package):
     # type: (str) -> str
     """If the package directory has the el version(s) at the end, e.g.
@@ -116,9 +80,7 @@ def chop_package_el_suffix(package):
     chop them off. This gives us the "base" package name for adding to the
     Koji tag.
     """
-    el_pattern = re.compile(r"([.]el\d+)+$")
-    real_package = el_pattern.sub("", package)
-    return real_package
+    return _EL_SUFFIX_RE.sub("", package)
 
 
 class KojiInter(object):
@@ -718,16 +680,51 @@ class KojiHelper(KojiLibInter):
     Mostly dealing with querying packages, builds, and tags.
     Primarily used for osg-promote.
     """
-    tags_cache = []
-    tagged_builds_cache = {}
-    tagged_packages_cache = {}
-
     def __init__(self, do_login):
         """Connect to koji-hub. Authenticate if 'do_login' is True."""
         super(KojiHelper, self).__init__()
+        self.tags_cache = []
+        self.tagged_builds_cache = {}
+        self.tagged_packages_cache = {}
+        self.latest_builds_cache = {}
+        self.buildinfo_cache = {}
         self.read_config_file()
         self.init_koji_session(login=do_login)
 
+    def invalidate_tag(self, tag):
+        """Forget what we know about the contents of `tag`, e.g. after
+        tagging a build into it."""
+        self.tagged_builds_cache.pop(tag, None)
+        self.tagged_packages_cache.pop(tag, None)
+        for key in [key for key in self.latest_builds_cache if key[1] == tag]:
+            del self.latest_builds_cache[key]
+
+    def tag_build(self, tag, build, force=False):
+        task_id = super(KojiHelper, self).tag_build(tag, build, force)
+        self.invalidate_tag(tag)
+        return task_id
+
+    @koji_error_wrap('tagging')
+    def tag_builds(self, tag_build_pairs):
+        """Call tagBuild for each (tag, build NVR) pair in `tag_build_pairs`
+        in a multicall (sent MULTICALL_BATCH_SIZE pairs per request).  Returns
+        a (task ID, error) pair for each, in the same order: error is None if
+        the tagBuild call went through, otherwise the task ID is None and
+        error is the reason koji gave for refusing to tag the build.
+
+        """
+        with self.kojisession.multicall(batch=MULTICALL_BATCH_SIZE) as mc:
+            calls = [mc.tagBuild(tag, build) for tag, build in tag_build_pairs]
+        results = []
+        for call in calls:
+            try:
+                results.append((call.result, None))
+            except kojilib.GenericError as err:
+                results.append((None, str(err)))
+        for tag in set(tag for tag, _ in tag_build_pairs):
+            self.invalidate_tag(tag)
+        return results
+
     def get_build_in_tag(self, tag, pkg_or_build):
         """Return the build matching 'pkg_or_build' in 'tag'.
         If pkg_or_build is not in the tag, returns None. Otherwise:
@@ -747,8 +744,31 @@ class KojiHelper(KojiLibInter):
         buildinfo = self.koji_get_build(build_nvr)
         return f"{self.weburl}/buildinfo?buildID={buildinfo['id']}"
 
+    def get_build_uris(self, build_nvrs: List[str]) -> Dict[str, str]:
+        """Like get_build_uri() for several builds at once, but with only one
+        round trip to the hub.  Returns a dict of URIs keyed by NVR.
+
+        """
+        build_nvrs = list(dict.fromkeys(build_nvrs))
+        return {nvr: f"{self.weburl}/buildinfo?buildID={buildinfo['id']}"
+                for nvr, buildinfo in zip(build_nvrs, self.koji_get_builds(build_nvrs))}
+
     def koji_get_build(self, build_nvr):
-        return self.kojisession.getBuild(build_nvr)
+        if build_nvr not in self.buildinfo_cache:
+            self.buildinfo_cache[build_nvr] = self.kojisession.getBuild(build_nvr)
+        return self.buildinfo_cache[build_nvr]
+
+    @koji_error_wrap('getting builds')
+    def koji_get_builds(self, build_nvrs):
+        """Call getBuild for each of `build_nvrs` not already cached in a
+        single multicall.  Returns the buildinfo dicts in the same order."""
+        missing = [nvr for nvr in dict.fromkeys(build_nvrs) if nvr not in self.buildinfo_cache]
+        if missing:
+            with self.kojisession.multicall(strict=True, batch=MULTICALL_BATCH_SIZE) as mc:
+                calls = [(nvr, mc.getBuild(nvr)) for nvr in missing]
+            for nvr, call in calls:
+                self.buildinfo_cache[nvr] = call.result
+        return [self.buildinfo_cache[nvr] for nvr in build_nvrs]
 
     def get_rpms_and_keyids_in_build(self, build_nvr: str) -> List[RpmKeyidsPair]:
         """Get the RPMs in the build with the given NVR and their signatures"""
@@ -762,7 +782,7 @@ class KojiHelper(KojiLibInter):
             log.warning("no rpms in build with nvr %s", build_nvr)
             return []
 
-        rpms_and_keyids = []
+        names_and_ids = []
         for rpm in rpms:
             try:
                 name = "{name}-{version}-{release}.{arch}.rpm".format(**rpm)
@@ -770,7 +790,15 @@ class KojiHelper(KojiLibInter):
             except KeyError as err:
                 log.warning("missing key %s in rpminfo", err)
                 continue
-            sigs = self.kojisession.queryRPMSigs(rpm_id) or []  # type: List[Dict]
+            names_and_ids.append((name, rpm_id))
+
+        # Get the signatures of all the RPMs in one round trip instead of one per RPM
+        with self.kojisession.multicall(strict=True, batch=MULTICALL_BATCH_SIZE) as mc:
+            sig_calls = [mc.queryRPMSigs(rpm_id) for _, rpm_id in names_and_ids]
+
+        rpms_and_keyids = []
+        for (name, _), call in zip(names_and_ids, sig_calls):
+            sigs = call.result or []  # type: List[Dict]
             sigkeys = set(filter(None, (x.get("sigkey", None) for x in sigs)))
             rpms_and_keyids.append(RpmKeyidsPair(rpm=name, keyids=sigkeys))
         log.debug("found rpms and signatures in %s:\n%r", build_nvr, rpms_and_keyids)
@@ -790,7 +818,35 @@ class KojiHelper(KojiLibInter):
 
     def get_latest_build(self, package, tag):
         """Return the NVR of the latest build of a package in a tag, or None"""
-        data = self.kojisession.listTagged(tag, latest=True, package=package)
+        if (package, tag) not in self.latest_builds_cache:
+            data = self.kojisession.listTagged(tag, latest=True, package=package)
+            self.latest_builds_cache[(package, tag)] = self._get_latest_nvr(data)
+        return self.latest_builds_cache[(package, tag)]
+
+    @koji_error_wrap('listing latest builds')
+    def prefetch_latest_builds(self, package_tag_pairs):
+        """Fill the get_latest_build() cache for all of the (package, tag)
+        pairs in `package_tag_pairs` with a multicall (sent
+        MULTICALL_BATCH_SIZE pairs per request).  Pairs that can't be looked
+        up are skipped.
+
+        """
+        pairs = [pair for pair in dict.fromkeys(package_tag_pairs) if pair not in self.latest_builds_cache]
+        if not pairs:
+            return
+        with self.kojisession.multicall(batch=MULTICALL_BATCH_SIZE) as mc:
+            calls = [(pair, mc.listTagged(pair[1], latest=True, package=pair[0])) for pair in pairs]
+        for pair, call in calls:
+            try:
+                data = call.result
+            except kojilib.GenericError as err:
+                log.debug("Couldn't prefetch latest build of %s in %s: %s", pair[0], pair[1], err)
+                continue
+            self.latest_builds_cache[pair] = self._get_latest_nvr(data)
+
+    @staticmethod
+    def _get_latest_nvr(data):
+        """Return the NVR from the results of listTagged(..., latest=True), or None"""
         if not data:
             return None
         else:
@@ -800,24 +856,66 @@ class KojiHelper(KojiLibInter):
                 return None
 
     def get_tagged_builds(self, tag):
-        """Return a list of NVRs of all builds in a tag"""
-        if tag not in KojiHelper.tagged_builds_cache:
-            data = self.kojisession.listTagged(tag)
-            KojiHelper.tagged_builds_cache[tag] = [x['nvr'] for x in data]
-        return KojiHelper.tagged_builds_cache[tag]
+        """Return a frozenset of NVRs of all builds in a tag"""
+        if tag not in self.tagged_builds_cache:
+            self._cache_tagged_builds(tag, self.kojisession.listTagged(tag))
+        return self.tagged_builds_cache[tag]
+
+    def _cache_tagged_builds(self, tag, data):
+        """Save the results of listTagged(tag) for get_tagged_builds() and
+        get_tagged_packages().  Callers only do membership tests, so store sets.
+        Koji gives us the package name of each build, so we don't have to parse
+        it out of the NVR.
+
+        """
+        self.tagged_builds_cache[tag] = frozenset(x['nvr'] for x in data)
+        self.tagged_packages_cache[tag] = frozenset(x['name'] for x in data)
+
+    @koji_error_wrap('listing tagged builds')
+    def prefetch_tagged_builds(self, tags):
+        """Fill the get_tagged_builds() cache for all of `tags` with a
+        multicall (sent LIST_TAGGED_BATCH_SIZE tags per request) instead of
+        one round trip per tag.  Tags that can't be
+        listed are skipped; get_tagged_builds() will report the error if the
+        tag is actually used.
+
+        """
+        tags = [tag for tag in dict.fromkeys(tags) if tag not in self.tagged_builds_cache]
+        if not tags:
+            return
+        with self.kojisession.multicall(batch=LIST_TAGGED_BATCH_SIZE) as mc:
+            calls = [(tag, mc.listTagged(tag)) for tag in tags]
+        for tag, call in calls:
+            try:
+                data = call.result
+            except kojilib.GenericError as err:
+                log.debug("Couldn't prefetch builds in %s: %s", tag, err)
+                continue
+            self._cache_tagged_builds(tag, data)
 
     def get_tagged_packages(self, tag):
-        """Return a list of names of all builds in a tag"""
-        if tag not in KojiHelper.tagged_packages_cache:
-            KojiHelper.tagged_packages_cache[tag] = [split_nvr(x)[0] for x in self.get_tagged_builds(tag)]
-        return KojiHelper.tagged_packages_cache[tag]
+        """Return a frozenset of names of all builds in a tag"""
+        if tag not in self.tagged_packages_cache:
+            # get_tagged_builds() normally fills this in too
+            builds = self.get_tagged_builds(tag)
+            if tag not in self.tagged_packages_cache:
+                self.tagged_packages_cache[tag] = frozenset(split_nvr(x)[0] for x in builds)
+        return self.tagged_packages_cache[tag]
+
+    def tag_exists(self, tag):
+        """Return True if `tag` exists in koji.  Tags whose builds we have
+        already listed are known to exist, so this only queries koji for
+        other tags.
+
+        """
+        return tag in self.tagged_builds_cache or bool(self.get_first_tag('exact', tag))
 
     def get_tags(self):
         """Return a list of all tag names"""
-        if not KojiHelper.tags_cache:
+        if not self.tags_cache:
             data = self.kojisession.listTags(None, None)
-            KojiHelper.tags_cache = [x['name'] for x in data]
-        return KojiHelper.tags_cache
+            self.tags_cache = [x['name'] for x in data]
+        return self.tags_cache
 
     def get_task_state(self, task_id):
         """Return the symbolic state of the task (e.g. OPEN, CLOSED, etc.) as a string"""
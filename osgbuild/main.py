@@ -234,6 +234,18 @@ def valid_dvers(targets):
             dvers.add(dver)
     return sorted(dvers)
 
+# Patterns for the 'versioned' osg targets, in the order they should be tried
+# (more specific ones first), along with the repo hint names (with the osg
+# version substituted in) and the target hint to use for a match
+_VERSIONED_TARGET_PATTERNS = [
+    (re.compile(r'osg-([0-9.]+)-el\d+-empty'), ["%s-empty"], 'osg-%s-%%(dver)s-empty'),
+    (re.compile(r'osg-([0-9.]+)-el\d+-contrib'), ["%s-contrib"], 'osg-%s-%%(dver)s-contrib'),
+    (re.compile(r'osg-([0-9.]+)-el\d+'), ["%s", "osg-%s"], 'osg-%s-%%(dver)s'),
+    (re.compile(r'osg-(\d+)-main-el\d+'), ["%s-main", "osg-%s"], 'osg-%s-main-%%(dver)s'),
+    (re.compile(r'osg-([0-9.]+)-upcoming-el\d+'), ["%s-upcoming"], 'osg-%s-upcoming-%%(dver)s'),
+    (re.compile(r'osg-(\d+)-internal-el\d+'), ["%s-internal"], 'osg-%s-internal-%%(dver)s'),
+]
+
 __repo_hints_cache = None
 def repo_hints(targets):
     """Return the valid arguments for --repo and the target and tag hints
@@ -251,30 +263,16 @@ def repo_hints(targets):
         __repo_hints_cache = REPO_HINTS_STATIC.copy()
         if targets:
             for target in targets:
-                osg_match = re.match(r'osg-([0-9.]+)-el\d+', target)
-                osg_main_match = re.match(r'osg-(\d+)-main-el\d+', target)
-                osg_upcoming_match = re.match(r'osg-([0-9.]+)-upcoming-el\d+', target)
-                osg_internal_match = re.match(r'osg-(\d+)-internal-el\d+', target)
-                osg_empty_match = re.match(r'osg-([0-9.]+)-el\d+-empty', target)
-                osg_contrib_match = re.match(r'osg-([0-9.]+)-el\d+-contrib', target)
-                if osg_empty_match:
-                    osgver = osg_empty_match.group(1)
-                    __repo_hints_cache["%s-empty" % osgver] = {'target': 'osg-%s-%%(dver)s-empty' % osgver, 'tag': 'osg-%(dver)s'}
-                elif osg_contrib_match:
-                    osgver = osg_contrib_match.group(1)
-                    __repo_hints_cache["%s-contrib" % osgver] = {'target': 'osg-%s-%%(dver)s-contrib' % osgver, 'tag': 'osg-%(dver)s'}
-                elif osg_match:
-                    osgver = osg_match.group(1)
-                    __repo_hints_cache[osgver] = __repo_hints_cache['osg-%s' % osgver] = {'target': 'osg-%s-%%(dver)s' % osgver, 'tag': 'osg-%(dver)s'}
-                elif osg_main_match:
-                    osgver = osg_main_match.group(1)
-                    __repo_hints_cache["%s-main" % osgver] = __repo_hints_cache['osg-%s' % osgver] = {'target': 'osg-%s-main-%%(dver)s' % osgver, 'tag': 'osg-%(dver)s'}
-                elif osg_upcoming_match:
-                    osgver = osg_upcoming_match.group(1)
-                    __repo_hints_cache["%s-upcoming" % osgver] = {'target': 'osg-%s-upcoming-%%(dver)s' % osgver, 'tag': 'osg-%(dver)s'}
-                elif osg_internal_match:
-                    osgver = osg_internal_match.group(1)
-                    __repo_hints_cache["%s-internal" % osgver] = {'target': 'osg-%s-internal-%%(dver)s' % osgver, 'tag': 'osg-%(dver)s'}
+                if not target.startswith('osg-'):
+                    continue
+                for pattern, hint_names, target_hint in _VERSIONED_TARGET_PATTERNS:
+                    match = pattern.match(target)
+                    if match:
+                        osgver = match.group(1)
+                        hint = {'target': target_hint % osgver, 'tag': 'osg-%(dver)s'}
+                        for hint_name in hint_names:
+                            __repo_hints_cache[hint_name % osgver] = hint
+                        break
 
     return __repo_hints_cache
 
@@ -514,12 +512,15 @@ rpmbuild     Build using rpmbuild(8) on the local machine
 # end of parse_cmdline_args()
 
 
+_DVER_RE = re.compile(r'\b(el\d+)\b')
+
+
 def get_dver_from_string(s):
     """Get the EL major version from a string containing it.
     Return None if not found."""
     if not s:
         return None
-    match = re.search(r'\b(el\d+)\b', s)
+    match = _DVER_RE.search(s)
     if match is not None:
         return match.group(1)
     else:
@@ -1,12 +1,11 @@
 #!/usr/bin/env python3
 import configparser
+import contextlib
 import os
-import shutil
+import stat
 from string import Template
 import sys
 
-from optparse import OptionParser
-
 from osgbuild.constants import (
     DATA_FILE_SEARCH_PATH,
     DEFAULT_AUTHTYPE,
@@ -15,12 +14,14 @@ from osgbuild.constants import (
 from osgbuild.utils import (
     ask,
     ask_yn,
+    atomic_unslurp,
     find_file,
     safe_make_backup,
     safe_makedirs,
     shell_quote)
 from osgbuild.error import Error, KojiError
-from osgbuild import kojiinter
+# Not kojiinter: importing the koji library would slow down every invocation
+from osgbuild.koji_config import get_koji_config_from_string
 
 
 OLD_CLIENT_CERT_FILE = os.path.join(KOJI_USER_CONFIG_DIR, "client.crt")
@@ -33,23 +34,23 @@ DEFAULT_CLIENT_CERT_FILE = "client.crt"
 
 PROGRAM_NAME = os.path.basename(sys.argv[0])
 
-RUN_SETUP_MSG = """
-Run '%s setup' to set up a koji environment containing the
-necessary files in %s.""" % (PROGRAM_NAME, OSG_KOJI_USER_CONFIG_DIR)
+RUN_SETUP_MSG = f"""
+Run '{PROGRAM_NAME} setup' to set up a koji environment containing the
+necessary files in {OSG_KOJI_USER_CONFIG_DIR}."""
 
-EXTRA_HELP = """
-%s adds the following commands:
-        setup                     Initialize the configuration in %s
+EXTRA_HELP = f"""
+{PROGRAM_NAME} adds the following commands:
+        setup                     Initialize the configuration in {OSG_KOJI_USER_CONFIG_DIR}
                                   See "setup --help" for options.
-""" % (PROGRAM_NAME, OSG_KOJI_USER_CONFIG_DIR)
+"""
 
 MANUAL_CERT_INSTALL_MSG_TEMPLATE = """
-Could not find user cert (%(user_cert)s) and/or key (%(user_key)s).
+Could not find user cert ({user_cert}) and/or key ({user_key}).
 You must manually copy your certs:
 
-    (cat usercert.pem; echo; cat userkey.pem) > %(new_client_cert_path)s
-    dos2unix %(new_client_cert_path)s
-    chmod 0600 %(new_client_cert_path)s
+    (cat usercert.pem; echo; cat userkey.pem) > {new_client_cert_path}
+    dos2unix {new_client_cert_path}
+    chmod 0600 {new_client_cert_path}
 
 where 'usercert.pem' and 'userkey.pem' are your X.509 public and private keys.
 """
@@ -75,6 +76,8 @@ def setup_parse_args(args):
     """Parse the arguments given on the command line for the setup command.
     Return the 'options' object, containing the keyword arguments.
     """
+    # Only needed for setup; avoid the import for koji passthrough commands
+    from optparse import OptionParser
 
     parser = OptionParser("""%prog setup [options]""")
 
@@ -130,8 +133,14 @@ def setup_parse_args(args):
     return options
 
 
+def get_koji_config_template_path():
+    """Return the location of the koji config template; raise
+    FileNotFoundInSearchPathError if it isn't in the data file directories."""
+    return find_file(KOJI_CONFIG_TEMPLATE, DATA_FILE_SEARCH_PATH, strict=True)
+
+
 def make_config_text(authtype, principal):
-    template_path = find_file(KOJI_CONFIG_TEMPLATE, DATA_FILE_SEARCH_PATH)
+    template_path = get_koji_config_template_path()
     if os.path.exists(SERVERCA_REDHAT):
         serverca = SERVERCA_REDHAT
     elif os.path.exists(SERVERCA_UBUNTU):
@@ -207,43 +216,53 @@ you should say yes.
             assert answer == "s"
             authtype = "ssl"
     config_text = make_config_text(authtype, principal)
-    with open(new_koji_config_path, "w") as config_fh:
-        config_fh.write(config_text)
+    # Give the file the permissions open() would have, i.e. follow the umask
+    atomic_unslurp(new_koji_config_path, config_text, mode=0o666 & ~current_umask())
 
 
-def with_safe_umask(function_to_wrap):
-    """decorator to set the umask to 0077 and restore it when we're done"""
-    def wrapped_function(*args, **kwargs):  # pylint: disable=missing-docstring
-        old_umask = os.umask(0o077)
-        try:
-            return function_to_wrap(*args, **kwargs)
-        finally:
-            os.umask(old_umask)
-    return wrapped_function
+def current_umask():
+    """Return the process's umask without changing it"""
+    umask = os.umask(0o077)
+    os.umask(umask)
+    return umask
+
+
+@contextlib.contextmanager
+def safe_umask(mask=0o077):
+    """context manager to set the umask to 0077 and restore it when we're done"""
+    old_umask = os.umask(mask)
+    try:
+        yield
+    finally:
+        os.umask(old_umask)
 
 
-@with_safe_umask
 def copy_old_client_cert(new_client_cert_path):
     """Copy an old client cert to the new destination"""
-    safe_make_backup(new_client_cert_path)
-    try:
-        shutil.copy(OLD_CLIENT_CERT_FILE, new_client_cert_path)
-    except EnvironmentError as err:
-        raise Error("Unable to copy client cert: %s" % err)
+    with safe_umask():
+        safe_make_backup(new_client_cert_path)
+        try:
+            with open(OLD_CLIENT_CERT_FILE, "rb") as old_client_cert_fh:
+                atomic_unslurp(new_client_cert_path, old_client_cert_fh.read(), mode=0o600)
+        except EnvironmentError as err:
+            raise Error("Unable to copy client cert: %s" % err)
 
 
-@with_safe_umask
 def create_client_cert_from_cert_and_key(new_client_cert_path, user_cert, user_key):  # pylint: disable=invalid-name
     """Combine `user_cert` and `user_key` to create a new cert file at
     `new_client_cert_path`.
     """
-    safe_make_backup(new_client_cert_path)
-    # Concatenate the cert and key; make sure there is a newline between them
-    os.system("(cat %s; echo; cat %s) > %s" % (shell_quote(user_cert),
-                                               shell_quote(user_key),
-                                               shell_quote(new_client_cert_path)))
-    # Convert DOS line endings; use sed because dos2unix might not be installed
-    os.system("sed -i -e 's/\015$//g' %s" % shell_quote(new_client_cert_path))
+    with safe_umask():
+        safe_make_backup(new_client_cert_path)
+        try:
+            # Concatenate the cert and key; make sure there is a newline between them
+            with open(user_cert, "rb") as cert_fh, open(user_key, "rb") as key_fh:
+                data = cert_fh.read() + b"\n" + key_fh.read()
+            # Convert DOS line endings
+            data = data.translate(None, b"\r")
+            atomic_unslurp(new_client_cert_path, data, mode=0o600)
+        except EnvironmentError as err:
+            raise Error("Unable to create client cert: %s" % err)
 
 
 def setup_koji_client_cert(user_cert, user_key):
@@ -280,7 +299,9 @@ Reuse that file?
                                              user_cert, user_key))
         return
     # if we get here, nothing worked
-    print(MANUAL_CERT_INSTALL_MSG_TEMPLATE % locals())
+    print(MANUAL_CERT_INSTALL_MSG_TEMPLATE.format(user_cert=user_cert,
+                                                  user_key=user_key,
+                                                  new_client_cert_path=new_client_cert_path))
     sys.exit(1)
 
 
@@ -304,12 +325,18 @@ def run_setup(options):
 
 def verify_koji_config(config_file):
     """Ensure the koji config file exists and the files it references also exist.
-    Returns the koji config."""
+    Returns the koji config and the authtype it specifies (or the default)."""
     try:
-        koji_config = kojiinter.get_koji_config(config_file)
+        with open(config_file) as config_fh:
+            config_text = config_fh.read()
+    except FileNotFoundError:
+        raise RunSetupError(f"No Koji config found at {config_file}")
+    except EnvironmentError as err:
+        raise RunSetupError(f"Couldn't read Koji config file at {config_file}: {err}")
+    try:
+        koji_config = get_koji_config_from_string(config_text, config_file)
     except KojiError as err:
-        raise RunSetupError("%s\nKoji config file not found at %s, "
-                            "or has invalid contents." % (err, config_file))
+        raise RunSetupError("%s\nKoji config file at %s has invalid contents." % (err, config_file))
     try:
         authtype = koji_config.get("koji", "authtype")
     except configparser.NoOptionError:
@@ -322,17 +349,19 @@ def verify_koji_config(config_file):
 
         config_dir = os.path.dirname(config_file)
         fullpath = os.path.join(config_dir, client_cert_file)
-        if not os.path.lexists(fullpath):
+        try:
+            cert_stat = os.lstat(fullpath)
+        except OSError:
             raise RunSetupError("Client cert file not found at %s" % fullpath)
-        elif not os.path.exists(fullpath):
-            # lexists() is True for a broken symlink, exists() is False
+        # Only a symlink can be broken; don't stat the target of a regular file
+        if stat.S_ISLNK(cert_stat.st_mode) and not os.path.exists(fullpath):
             target = os.readlink(fullpath)
             print("%s -> %s is a broken symlink.\n"
                   "Note: grid certificates no longer function; if you were using them before,\n"
                   "please re-run osg-koji setup."
                   % (fullpath, target),
                   file=sys.stderr)
-    return koji_config
+    return koji_config, authtype
 
 
 def run_koji(args=None, use_exec=False):
@@ -366,11 +395,7 @@ def main(argv=None, use_exec=True):
             if argv[1] == "setup":
                 options = setup_parse_args(argv[2:])
                 run_setup(options)
-                koji_config = verify_koji_config(koji_config_path)
-                try:
-                    authtype = koji_config.get("koji", "authtype")
-                except configparser.NoOptionError:
-                    authtype = DEFAULT_AUTHTYPE
+                _, authtype = verify_koji_config(koji_config_path)
                 print("""
 Setup is done. You may verify that you can log in via the command-line
 tools by running:
@@ -387,15 +412,9 @@ You may need to run `kinit` before running the above command.
                 run_koji(args=argv[1:])
                 print(EXTRA_HELP)
             else:
-                if not os.path.exists(koji_config_path):
-                    raise RunSetupError(f"No Koji config found at {koji_config_path}")
-                koji_config = verify_koji_config(koji_config_path)
-                try:
-                    authtype = koji_config.get("koji", "authtype")
-                except configparser.NoOptionError:
-                    authtype = DEFAULT_AUTHTYPE
+                _, authtype = verify_koji_config(koji_config_path)
                 args = ["--config=" + koji_config_path,
-                        "--authtype=%s" % authtype] + argv[1:]
+                        f"--authtype={authtype}"] + argv[1:]
                 return run_koji(args=args, use_exec=use_exec)
         else:
             run_koji()
@@ -3,25 +3,36 @@ and import them back.  Requires access to the signing key and the "sign"
 Koji permission (or "admin").
 """
 from argparse import ArgumentParser
-import glob
+from concurrent.futures import ThreadPoolExecutor
+import errno
+import functools
 import logging
 import re
 import os
 import shutil
 import subprocess
 import sys
+import threading
 import traceback
 from tempfile import TemporaryDirectory
-from typing import List, Optional, Dict
+from typing import List, Optional, Dict, TYPE_CHECKING
 
 from . import constants
 from .error import Error, ProgramNotFoundError, KojiError, ConfigErrors, UsageError
 from . import utils
-from .kojiinter import KojiHelper
 from .utils import IniConfiguration, print_line
 
+if TYPE_CHECKING:
+    # Imported in sign_and_import_builds() instead: importing the koji
+    # library is slow, and osg-promote only needs the key config from here
+    from .kojiinter import KojiHelper
+
 log = logging.getLogger(__name__)
 
+IMPORT_SIG_CHUNK_SIZE = 200
+SIGN_BATCH_SIZE = 5  # max builds downloaded and signed together by one rpm --resign run
+KEYID_RE = re.compile(r"[0-9a-fA-F]{8}")
+
 
 class SigningError(Error):
     """Base class for errors in the signing module"""
@@ -35,65 +46,65 @@ class SigningKey(object):
         self.keyid = keyid
         self.dvers = dvers
         self.digest_algo = digest_algo or None
-        self.all_signing_keyids = []
+        self.all_signing_keyids = None  # filled in by query_all_signing_keyids()
 
     def query_all_signing_keyids(self):
         """Asks GPG for the keyids of the primary and all subkeys that can be
         used to sign packages (i.e. have 's' or 'S' in the 'capabilities' field.
 
-        Saves the results.
+        Saves the results, including an empty list if gpg failed, so gpg is
+        only run once per key.
         """
-        if not self.all_signing_keyids:
-            ret = subprocess.run(["gpg", "--list-keys", "--with-colons", self.keyid],
+        if self.all_signing_keyids is None:
+            # --fast-list-mode skips computing validity and trust, which we don't need
+            ret = subprocess.run(["gpg", "--batch", "--fast-list-mode", "--list-keys", "--with-colons", self.keyid],
                                  stdout=subprocess.PIPE,
-                                 stderr=subprocess.PIPE,
-                                 encoding="latin-1")
+                                 stderr=subprocess.PIPE)
             if ret.returncode != 0:
                 log.warning("Could not get information about subkeys for %s", self.keyid)
                 log.warning("gpg exited with return code %d", ret.returncode)
-                log.warning("Output:\n%s", ret.stdout)
-                log.warning("Error:\n%s", ret.stderr)
+                log.warning("Output:\n%s", ret.stdout.decode("latin-1"))
+                log.warning("Error:\n%s", ret.stderr.decode("latin-1"))
+                self.all_signing_keyids = []
                 return []
 
+            # Parse the output as bytes; we only need a few ASCII fields from the pub/sub records
             signing_keyids = []
             for line in ret.stdout.splitlines():
                 try:
-                    if ":" not in line:
-                        continue
-                    fields = line.split(":")
-                    type_of_record = fields[0]
-                    if type_of_record not in ["pub", "sub"]:  # primary or subkey
+                    # only look at primary keys and subkeys; skip other records without splitting them
+                    if not line.startswith((b"pub:", b"sub:")):
                         continue
-                    key_id = fields[4].lower()[-8:]
+                    fields = line.split(b":")
                     capabilities = fields[11]
-                    if 's' in capabilities.lower():  # this key can sign
-                        signing_keyids.append(key_id)
+                    if b"s" in capabilities.lower():  # this key can sign
+                        signing_keyids.append(fields[4][-8:].lower().decode("ascii"))
                 except IndexError as err:
-                    log.warning("Unexpected output from gpg: IndexError %s for line\n%s", err, line)
+                    log.warning("Unexpected output from gpg: IndexError %s for line\n%s", err, line.decode("latin-1"))
+                    self.all_signing_keyids = []
                     return []
 
             self.all_signing_keyids = signing_keyids
         return self.all_signing_keyids
 
+    def _gpg_lists_key(self, list_option: str) -> bool:
+        """Return True if `gpg <list_option> <keyid>` finds this key"""
+        err = subprocess.call(["gpg", "--batch", list_option, self.keyid],
+                              stdout=subprocess.DEVNULL,
+                              stderr=subprocess.DEVNULL)
+        return err == 0
+
     def have_public_key(self) -> bool:
         """Return True if we have the public key for this SigningKey.
 
         """
-        with open(os.devnull, "w") as devnull:
-            err = subprocess.call(["gpg", "--list-keys", self.keyid],
-                                  stdout=devnull,
-                                  stderr=devnull)
-            return err == 0
+        return self._gpg_lists_key("--list-keys")
 
     def have_secret_key(self) -> bool:
-        """Return True if we have the public key for this SigningKey.
+        """Return True if we have the secret key for this SigningKey.
 
         """
-        with open(os.devnull, "w") as devnull:
-            err = subprocess.call(["gpg", "--list-secret-keys", self.keyid],
-                                  stdout=devnull,
-                                  stderr=devnull)
-            return err == 0
+        return self._gpg_lists_key("--list-secret-keys")
 
     def __str__(self):
         return "%s (%s)" % (self.name, self.keyid)
@@ -136,7 +147,7 @@ class SigningKeysConfig(IniConfiguration):
             errors = []
             if not keyid:
                 errors.append("keyid not provided")
-            elif not re.match(r'[0-9a-zA-Z]{8}', keyid):
+            elif not KEYID_RE.fullmatch(keyid):
                 errors.append("keyid %r is not an 8-char hex string" % keyid)
             if not dvers:
                 errors.append("dvers not provided or empty")
@@ -146,16 +157,39 @@ class SigningKeysConfig(IniConfiguration):
         return signing_keys
 
 
+@functools.lru_cache()
+def _which(program: str) -> Optional[str]:
+    """utils.which(), but only searching PATH once per program.
+    main() sets PATH before anything calls this.
+    """
+    return utils.which(program)
+
+
 def check_program_requirements():
     """Checks if we have the necessary programs to do everything.
     Raises ProgramNotFoundError if we're missing something.
 
     """
     for program in "rpm", "osg-koji", "rpmsign", "gpg":
-        if not utils.which(program):
+        if not _which(program):
             raise ProgramNotFoundError(program)
 
 
+def start_gpg_agent():
+    """Make sure gpg-agent is running before we start signing, so every gpg
+    run (including ones from parallel workers) connects to the same agent
+    instead of racing to start one.  Does nothing if gpg-connect-agent isn't
+    available.
+
+    """
+    if not _which("gpg-connect-agent"):
+        log.debug("gpg-connect-agent not found; not starting gpg-agent")
+        return
+    ret = subprocess.run(["gpg-connect-agent", "/bye"], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    if ret.returncode != 0:
+        log.warning("Could not start gpg-agent (gpg-connect-agent exited with %d)", ret.returncode)
+
+
 def check_permissions_requirements():
     """Checks if we have the permissions necessary to do everything.
     This means Koji 'sign'.  'admin' will also do.
@@ -177,72 +211,135 @@ def do_list_keys(config: SigningKeysConfig):
     print("Signing keys:")
     utils.print_line()
     fmt = "%-7s %-31s %-11s %-17s %-7s"
-    gpg_bin = utils.which("gpg")
+    gpg_bin = _which("gpg")
     if not gpg_bin:
         log.warning("gpg not found; unable to check which keys are available")
     print(fmt % (" Sign ", " Name ", " Key ID ", " Supported dvers ", " Digest algo "))
     print(fmt % ("------", "------", "--------", "-----------------", "-------------"))
-    for sk in sorted(config.signing_keys_by_name.values()):
+    signing_keys = sorted(config.signing_keys_by_name.values())
+    have_secret_key = {}
+    if gpg_bin:
+        # Each check runs gpg; run them concurrently instead of one by one
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            have_secret_key = dict(zip(signing_keys, executor.map(SigningKey.have_secret_key, signing_keys)))
+    for sk in signing_keys:
         can_sign = "  ?"
         if gpg_bin:
-            can_sign = "  Y" if sk.have_secret_key() else "  N"
+            can_sign = "  Y" if have_secret_key[sk] else "  N"
         print(fmt % (can_sign, sk.name, sk.keyid, ", ".join(sk.dvers), sk.digest_algo or "DEFAULT"))
 
 
 def sign_rpms(signing_key, rpms):
+    gpg_bin = _which("gpg")
     rpm_cmd = ["rpm", "--resign"]
     rpm_cmd += ["--define", f"_signature gpg",
                 "--define", f"_gpg_name {signing_key.keyid}",
-                "--define", f"_gpgbin {utils.which('gpg')}",
-                "--define", f"__gpg {utils.which('gpg')}",
+                "--define", f"_gpgbin {gpg_bin}",
+                "--define", f"__gpg {gpg_bin}",
                 ]
     if signing_key.digest_algo:
         rpm_cmd += ["--define", f"_gpg_digest_algo {signing_key.digest_algo}"]
     rpm_cmd += rpms
 
+    # Allow more time when signing a large batch of RPMs
+    timeout = max(600, 2 * len(rpms))
     try:
         log.debug("Signing rpm with command %r", rpm_cmd)
-        subprocess.run(rpm_cmd, timeout=600, check=True)
+        subprocess.run(rpm_cmd, timeout=timeout, check=True)
     except (subprocess.CalledProcessError, subprocess.TimeoutExpired) as err:
         raise SigningError("Signing failed: %s" % err) from err
 
     log.info("Signing complete.")
 
 
-def import_signatures(rpms: List[str]):
-    """Import the signatures from the given RPM files into Koji."""
+def import_signatures(rpms: List[str], cwd: Optional[str] = None, chunk_size=IMPORT_SIG_CHUNK_SIZE):
+    """Import the signatures from the given RPM files into Koji.
+    Relative paths in `rpms` are relative to `cwd` if it is given.
+
+    The RPMs are passed to `osg-koji import-sig` `chunk_size` at a time, so a
+    big batch can't overflow the command line, and each chunk gets its own
+    timeout.  Signatures from chunks that have already finished stay
+    imported if a later chunk fails.
+    """
+    for idx in range(0, len(rpms), chunk_size):
+        chunk = rpms[idx:idx + chunk_size]
+        try:
+            subprocess.run(["osg-koji", "import-sig"] + chunk, cwd=cwd, timeout=900, check=True)
+        except (subprocess.CalledProcessError, subprocess.TimeoutExpired) as err:
+            raise SigningError("Import of signatures failed (%s)" % err) from err
+
+
+def _link_or_copy(src: str, dst: str):
+    """Hard link `src` to `dst`, replacing `dst` if it exists.  RPMs can be
+    large so this avoids copying the data; fall back to copying if the two
+    are on different filesystems or hard links aren't allowed.
+
+    """
     try:
-        subprocess.run(["osg-koji", "import-sig"] + rpms, timeout=900, check=True)
-    except (subprocess.CalledProcessError, subprocess.TimeoutExpired) as err:
-        raise SigningError("Import of signatures failed (%s)" % err) from err
+        os.unlink(dst)
+    except FileNotFoundError:
+        pass
+    try:
+        os.link(src, dst)
+    except OSError as err:
+        if err.errno not in (errno.EXDEV, errno.EPERM):
+            raise
+        shutil.copy(src, dst)
 
 
-def sign_and_import_build(build_nvr: str, signing_key: SigningKey, kojihelper: KojiHelper, results_dir=None,
-                          dry_run=False):
-    """Download RPMs for the given `build_nvr` and sign them with the given
-    `signing_key`.  Import back into Koji the ones that Koji doesn't already
-    have signatures with this key for.
+def _list_rpms(dirpath: str) -> List[str]:
+    """Return the sorted paths of the RPM files in `dirpath`.
+    Sorting keeps the rpm --resign command line deterministic.
+    """
+    with os.scandir(dirpath) as entries:
+        return sorted(entry.path for entry in entries if entry.name.endswith(".rpm") and entry.is_file())
 
-    Optionally put the downloaded RPMs in `results_dir`.
 
-    Note: rpm may decide to sign using a subkey of the given signing key, not
-          the primary key.
+def _get_rpms_to_import(build_nvr: str, signing_keyids: List[str], kojihelper: "KojiHelper") -> List[str]:
+    """Return the names of the RPMs in `build_nvr` that Koji does not have a
+    signature for from any of `signing_keyids`.
 
     """
     rpms_and_keyids = kojihelper.get_rpms_and_keyids_in_build(build_nvr)
-    signing_keyids = signing_key.query_all_signing_keyids()
 
+    signing_keyids_set = frozenset(signing_keyids)
     rpms_to_import = []
     # ^^ we're actually importing _signatures_, not RPMs, but this is a list
     #    of RPM files to take the signatures from.
-    log.debug("signing_keyids: %r", signing_keyids)
     for rk in rpms_and_keyids:
         log.debug("rpm=%r signatures=%r", rk.rpm, rk.keyids)
-        if set(signing_keyids).isdisjoint(rk.keyids):
+        if signing_keyids_set.isdisjoint(rk.keyids):
             log.debug("needs signing; adding")
             rpms_to_import.append(rk.rpm)
     log.info("%d out of %d RPMs in %s need signing and importing",
              len(rpms_to_import), len(rpms_and_keyids), build_nvr)
+    return rpms_to_import
+
+
+def sign_and_import_build(build_nvr: str, signing_key: SigningKey, kojihelper: "KojiHelper", results_dir=None,
+                          dry_run=False):
+    """Download RPMs for the given `build_nvr` and sign them with the given
+    `signing_key`.  Import back into Koji the ones that Koji doesn't already
+    have signatures with this key for.
+
+    Optionally put the downloaded RPMs in `results_dir`.
+
+    Note: rpm may decide to sign using a subkey of the given signing key, not
+          the primary key.
+
+    """
+    sign_and_import_build_batch([build_nvr], signing_key, kojihelper, results_dir=results_dir, dry_run=dry_run)
+
+
+def sign_and_import_build_batch(build_nvrs: List[str], signing_key: SigningKey, kojihelper: "KojiHelper",
+                                results_dir=None, dry_run=False):
+    """Like sign_and_import_build() but for several builds at once: download
+    all of them, sign all of their RPMs with a single `rpm --resign` run (so
+    rpm and gpg only start up once), then import the signatures.
+
+    """
+    signing_keyids = signing_key.query_all_signing_keyids()
+    log.debug("signing_keyids: %r", signing_keyids)
 
     # RPMs are big -- use /var/tmp as the default if no environment variable overrides it (instead of /tmp)
     # fmt: off
@@ -253,26 +350,44 @@ def sign_and_import_build(build_nvr: str, signing_key: SigningKey, kojihelper: K
         "/var/tmp")))
     )
     # fmt: on
-    with TemporaryDirectory(prefix=f"osg-sign-{build_nvr}", dir=temproot) \
-            as workdir:
-        with utils.chdir(workdir):
+    prefix = f"osg-sign-{build_nvrs[0]}" if len(build_nvrs) == 1 else "osg-sign-"
+    with TemporaryDirectory(prefix=prefix, dir=temproot) as workdir:
+        rpms = []
+        rpms_to_import = []
+        for build_nvr in dict.fromkeys(build_nvrs):  # drop duplicates, keep order
+            build_rpms_to_import = _get_rpms_to_import(build_nvr, signing_keyids, kojihelper)
+            if not build_rpms_to_import and results_dir is None:
+                # Everything is already signed and the RPMs aren't wanted
+                # locally, so don't bother downloading them
+                log.info("Nothing to do for %s", build_nvr)
+                continue
+
+            # Download each build into its own subdirectory.  Pass cwd
+            # instead of using utils.chdir() since batches may be processed
+            # in parallel threads.
+            build_dir = os.path.join(workdir, build_nvr)
+            os.mkdir(build_dir)
             cmd = ["osg-koji", "download-build", "--debuginfo"]
             if not sys.stdout.isatty():
                 cmd.append("--noprogress")
             cmd.append(build_nvr)
-            utils.checked_call(cmd)
+            utils.checked_call(cmd, cwd=build_dir)
 
-        rpms = glob.glob(os.path.join(workdir, "*.rpm"))
+            rpms += _list_rpms(build_dir)
+            rpms_to_import += [os.path.join(build_nvr, rpm) for rpm in build_rpms_to_import]
+
+        if not rpms:
+            log.info("No signatures need to be imported")
+            return
         sign_rpms(signing_key, rpms)
 
         if results_dir is not None:
             results_dir = os.path.abspath(results_dir)
-            if not os.path.exists(results_dir):
-                os.mkdir(results_dir)
+            os.makedirs(results_dir, exist_ok=True)
             try:
                 for rpm in rpms:
                     dst = os.path.join(results_dir, os.path.basename(rpm))
-                    shutil.copy(rpm, dst)
+                    _link_or_copy(rpm, dst)
                     log.info("RPM copied to %s", dst)
             except OSError as err:
                 log.warning("Error copying RPMs back to %s: %s", results_dir, err)
@@ -282,12 +397,67 @@ def sign_and_import_build(build_nvr: str, signing_key: SigningKey, kojihelper: K
             return
 
         if rpms_to_import:
-            with utils.chdir(workdir):
-                import_signatures(rpms_to_import)
+            import_signatures(rpms_to_import, cwd=workdir)
         else:
             log.info("No signatures need to be imported")
 
 
+def sign_and_import_builds(build_nvrs: List[str], signing_key: SigningKey, do_login: bool, jobs=1,
+                           results_dir=None, dry_run=False):
+    """Sign and import `build_nvrs`.
+
+    The builds are split into batches of up to SIGN_BATCH_SIZE builds, each
+    handled by sign_and_import_build_batch(), so all the RPMs in a batch are
+    signed by a single `rpm --resign` run.  The batch size is capped so that
+    the temporary disk space needed stays bounded and a failure only affects
+    a few builds.
+
+    With one job, the batches are handled one after another, and the first
+    failure stops the run.
+
+    With more than one job, the batches are handled in parallel.  The work is almost entirely waiting on
+    subprocesses, so threads are used.  Koji sessions can't be shared between
+    threads, so each worker thread creates (and, if `do_login` is True, logs
+    in with) its own KojiHelper, which it reuses for all the batches it
+    handles; `jobs` workers means up to `jobs` logins.  A failure (including a
+    failed download) fails its whole batch but does not stop the other
+    batches; a SigningError listing the failed builds is raised at the end.
+
+    """
+    from .kojiinter import KojiHelper
+
+    batches = [build_nvrs[i:i + SIGN_BATCH_SIZE] for i in range(0, len(build_nvrs), SIGN_BATCH_SIZE)]
+    if jobs <= 1 or len(batches) <= 1:
+        kojihelper = KojiHelper(do_login=do_login)
+        for batch in batches:
+            sign_and_import_build_batch(batch, signing_key, kojihelper, results_dir=results_dir, dry_run=dry_run)
+        return
+
+    # Query gpg once here so the workers, which share signing_key, don't each run it
+    signing_key.query_all_signing_keyids()
+
+    thread_data = threading.local()
+
+    def _worker(batch):
+        kojihelper = getattr(thread_data, "kojihelper", None)
+        if kojihelper is None:
+            kojihelper = thread_data.kojihelper = KojiHelper(do_login=do_login)
+        sign_and_import_build_batch(batch, signing_key, kojihelper, results_dir=results_dir, dry_run=dry_run)
+
+    failed_builds = []
+    with ThreadPoolExecutor(max_workers=min(jobs, len(batches))) as executor:
+        futures = [(batch, executor.submit(_worker, batch)) for batch in batches]
+        for batch, future in futures:
+            try:
+                future.result()
+            except (Error, utils.CalledProcessError) as err:
+                log.error("Error signing and importing %s: %s", ", ".join(batch), err)
+                failed_builds += batch
+    if failed_builds:
+        raise SigningError("Signing and importing failed for %d build(s): %s" %
+                           (len(failed_builds), ", ".join(failed_builds)))
+
+
 def main(argv: List[str]):
     """Main function"""
     progdir = os.path.realpath(os.path.dirname(argv[0]))
@@ -318,13 +488,13 @@ def main(argv: List[str]):
             f"No signing key matching {args.signing_key} was found.\n"
             f"Run `{prog} --list-keys` to see which keys are available.")
 
+    start_gpg_agent()
+
     if not signing_key.have_secret_key():
         raise SigningError(f"Secret key for signing key {signing_key} not available.")
 
-    kojihelper = KojiHelper(do_login=not args.dry_run)
-
-    for build in args.build:
-        sign_and_import_build(build, signing_key, kojihelper, results_dir=args.results, dry_run=args.dry_run)
+    sign_and_import_builds(args.build, signing_key, do_login=not args.dry_run, jobs=args.jobs,
+                           results_dir=args.results, dry_run=args.dry_run)
 
 
 # end of main()
@@ -364,6 +534,18 @@ def parse_commandline_args(argv: List[str]):
         help="Copy the resulting signed RPMs to this directory; the directory "
              "will be created if it doesn't exist."
     )
+    parser.add_argument(
+        "-j", "--jobs",
+        type=int,
+        default=1,
+        help="Number of batches of builds to download, sign, and import at the same time. "
+             "Builds are grouped into batches of up to %d that are downloaded into the same "
+             "temporary directory and signed together. With 1, the batches are handled one at "
+             "a time and the first failure stops the run. With more, a failure in a batch fails "
+             "all of its builds, but the other batches continue; each job opens (and logs in to) "
+             "its own Koji session. "
+             "Default: %%(default)s" % SIGN_BATCH_SIZE
+    )
     parser.add_argument("--debug",
                         action="store_const",
                         const=logging.DEBUG,
@@ -390,6 +572,9 @@ def parse_commandline_args(argv: List[str]):
     if not args.build:
         parser.error("No builds specified.")
 
+    if args.jobs < 1:
+        parser.error("--jobs must be at least 1.")
+
     return args
 
 
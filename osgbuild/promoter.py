@@ -1,13 +1,14 @@
 """A package promotion script for OSG"""
 
 
+import bisect
+import collections
+import functools
 import logging
 import os
-import re
 import sys
-from typing import List, Optional, Dict, Set, Tuple
+from typing import List, Optional, Dict, FrozenSet, Set, Tuple, TYPE_CHECKING
 
-from osgbuild.kojiinter import KojiHelper
 from . import constants
 from . import error
 from . import osg_sign
@@ -16,6 +17,11 @@ from .osg_sign import SigningKey, SigningKeysConfig
 from .utils import comma_join, printf, print_table, IniConfiguration, split_nvr
 from optparse import OptionParser
 
+if TYPE_CHECKING:
+    # Not imported at runtime until needed: importing the koji library
+    # would slow down --help and command line errors
+    from .kojiinter import KojiHelper
+
 log = logging.getLogger(__name__)
 
 
@@ -36,6 +42,7 @@ class Route(object):
         self.repotag = repotag
         self.dvers = dvers
         self.extra_dvers = extra_dvers
+        self.supported_dvers = frozenset(dvers) | frozenset(extra_dvers)  # for membership tests
         self.required_keys = required_keys or []
 
     def required_keys_for_dver(self, dver):
@@ -45,6 +52,8 @@ class Route(object):
 
 
 class Build(object):
+    __slots__ = ("name", "version", "release_no_dist", "repotag", "dver")
+
     def __init__(self, name, version, release_no_dist, repotag, dver):
         self.name = name
         self.version = version
@@ -53,7 +62,10 @@ class Build(object):
         self.dver = dver
 
     @staticmethod
+    @functools.lru_cache(maxsize=2048)
     def new_from_nvr(nvr):
+        # Cached since the same build gets looked up for multiple routes and
+        # dvers; Build objects are never modified so they can be shared.
         name, version, release = split_nvr(nvr)
         release_no_dist, repotag, dver = split_repotag_dver(release)
 
@@ -123,6 +135,10 @@ class Configuration(IniConfiguration):
         self.routes = self.parse_routes(route_sections, self.signing_keys_by_name)
         self.aliases = self.parse_aliases(self.routes)
 
+        # Routes and aliases don't change after parsing; compute these once
+        self._all_names = sorted(list(self.routes.keys()) + list(self.aliases.keys()))
+        self._all_dvers = frozenset().union(*(route.supported_dvers for route in self.routes.values()))
+
     def parse_routes(self, route_sections, signing_keys):
         # type: (List[str], Dict[str, SigningKey]) -> Dict[str, Route]
         """Parse the 'route X' sections of the config file
@@ -220,15 +236,12 @@ class Configuration(IniConfiguration):
 
     @property
     def all_names(self):
-        return list(self.routes.keys()) + list(self.aliases.keys())
+        """Names of all routes and aliases, sorted"""
+        return self._all_names
 
     @property
     def all_dvers(self):
-        dvers = set()
-        for route in self.routes.values():
-            dvers.update(route.dvers)
-            dvers.update(route.extra_dvers)
-        return dvers
+        return self._all_dvers
 
 
 #
@@ -236,6 +249,43 @@ class Configuration(IniConfiguration):
 #
 
 
+def _is_dver(component: str) -> bool:
+    """Return True if `component` of a dist tag looks like a dver, e.g. "el9" """
+    return component.startswith("el") and component[2:].isdecimal()
+
+
+def _is_repotag(component: str, known_repotags: Optional[FrozenSet[str]]) -> bool:
+    r"""Return True if `component` of a dist tag is a repo tag: either one of
+    `known_repotags` or, if that's None, something that starts with [a-z]
+    followed by at least one word character (like the regex [a-z]\w+).
+
+    """
+    if known_repotags is not None:
+        if not known_repotags:
+            # Matches what the old "|".join(known_repotags) regex did: an
+            # empty alternation only matches an empty component
+            return component == ""
+        return component in known_repotags
+    return (len(component) > 1 and "a" <= component[0] <= "z" and
+            all(c.isalnum() or c == "_" for c in component[1:]))
+
+
+@functools.lru_cache(maxsize=4096)
+def _split_repotag_dver(build: str, known_repotags: Optional[FrozenSet[str]]) -> Tuple[str, str, str]:
+    """Cached implementation of split_repotag_dver()"""
+    head, _, last = build.rpartition(".")
+    if not head:
+        return build, "", ""
+    if _is_dver(last):
+        head2, _, maybe_repotag = head.rpartition(".")
+        if head2 and _is_repotag(maybe_repotag, known_repotags):
+            return head2, maybe_repotag, last
+        return head, "", last
+    if _is_repotag(last, known_repotags):
+        return head, last, ""
+    return build, "", ""
+
+
 def split_repotag_dver(build, known_repotags=None):
     """Split out the dist tag from the NVR of a build, returning a tuple
     containing (NVR (without dist tag), repo tag, dver).
@@ -256,30 +306,8 @@ def split_repotag_dver(build, known_repotags=None):
     tag on a release like "1.11".
 
     """
-    build_no_dist = build
-    repotag = ""
-    dver = ""
-
-    build_no_dist_pat = r"(?P<build_no_dist>.+)"
-    repotag_pat = r"(?P<repotag>[a-z]\w+)"
-    dver_pat = r"(?P<dver>el\d+)"
-    if known_repotags is not None:
-        repotag_pat = r"(?P<repotag>" + "|".join(known_repotags) + ")"
-
-    # order matters since later patterns are less specific and would match more
-    pat_1_repotag_and_dver = re.compile(build_no_dist_pat + r"\." + repotag_pat + r"\." + dver_pat + "$")
-    pat_2_dver_only = re.compile(build_no_dist_pat + r"\." + dver_pat + "$")
-    pat_3_repotag_only = re.compile(build_no_dist_pat + r"\." + repotag_pat + "$")
-
-    match = (pat_1_repotag_and_dver.match(build) or
-             pat_2_dver_only.match(build) or
-             pat_3_repotag_only.match(build))
-
-    if match:
-        groupdict = match.groupdict()
-        build_no_dist, repotag, dver = groupdict['build_no_dist'], groupdict.get('repotag', ''), groupdict.get('dver', '')
-
-    return build_no_dist, repotag, dver
+    # The results are cached; the same builds get looked up for every route and dver
+    return _split_repotag_dver(build, None if known_repotags is None else frozenset(known_repotags))
 
 
 def _bulletedlist(lst, prefix=" - "):
@@ -295,19 +323,26 @@ class Promoter(object):
     """
 
     def __init__(self,
-                 kojihelper: KojiHelper,
+                 kojihelper: "KojiHelper",
                  route_dvers_pairs: List[Tuple[Route, Set[str]]],
                  signing_keys: Dict[str, SigningKey],
                  try_to_sign=False
                  ) -> None:
-        self.tag_pkg_args = {}
+        self.tag_pkg_args = collections.defaultdict(list)
+        self.tag_nvr_pairs = set()  # (tag, nvr) already in tag_pkg_args, so we don't tag anything twice
         self.rejects = []
         self.kojihelper = kojihelper
         self.route_dvers_pairs = route_dvers_pairs
-        self.repotags = set(route.repotag for route, _ in self.route_dvers_pairs)
+        # frozenset so split_repotag_dver() can use it as a cache key as-is
+        self.repotags = frozenset(route.repotag for route, _ in self.route_dvers_pairs)
         self.signing_keys_by_name = signing_keys
         self.try_to_sign = try_to_sign
         self.failed_keys = set()  # keys that we have tried and failed to sign with, and shouldn't try again
+        self.valid_tags = {}  # (tag_hint, dver) -> tag that we have already found in koji
+        self.route_keyids = {}  # accepted signing keyids, keyed by (route, dver)
+        # destination tags, keyed by (route, dver), so add_promotion() doesn't format them per build
+        self.to_tags = {(route, dver): route.to_tag_hint % dver
+                        for route, dvers in self.route_dvers_pairs for dver in dvers}
 
     def add_promotion(self, pkg_or_build, ignore_rejects=False, ignore_signatures=False):
         """Run get_dver_build_pairs() for 'pkg_or_build', using from_tag_hint as the
@@ -321,8 +356,7 @@ class Promoter(object):
         for route, dvers in self.route_dvers_pairs:
             dver_build_pairs = self.get_dver_build_pairs(route, dvers, pkg_or_build, ignore_rejects)
             for dver, build in dver_build_pairs:
-                to_tag = route.to_tag_hint % dver
-                self.tag_pkg_args.setdefault(to_tag, [])
+                to_tag = self.to_tags[(route, dver)]
                 reject = None
                 if self.signing_keys_by_name:
                     reject = self.validate_signatures(route, dver, build)
@@ -337,8 +371,29 @@ class Promoter(object):
             self.rejects.append(Reject(pkg_or_build, Reject.REASON_DISTINCT_ACROSS_DISTS))
         else:
             for tag, build in tag_build_pairs:
+                if (tag, build.nvr) in self.tag_nvr_pairs:
+                    continue
+                self.tag_nvr_pairs.add((tag, build.nvr))
                 self.tag_pkg_args[tag].append(build)
 
+    def prefetch_builds(self, pkgs_or_builds):
+        """Look up the latest builds in the source tags of all the packages in
+        `pkgs_or_builds` with one koji call, instead of add_promotion() doing
+        a round trip per package, route, and dver.  Builds (as opposed to
+        packages) are found in the tag contents and don't need a lookup.
+
+        """
+        package_tag_pairs = []
+        for route, dvers in self.route_dvers_pairs:
+            for dver in sorted(dvers):
+                tag = self._get_valid_tag_for_dver(route.from_tag_hint, dver)
+                tagged_packages = self.kojihelper.get_tagged_packages(tag)
+                for pkg_or_build in pkgs_or_builds:
+                    pkg_or_build_no_dist = split_repotag_dver(pkg_or_build, self.repotags)[0]
+                    if pkg_or_build_no_dist in tagged_packages:
+                        package_tag_pairs.append((pkg_or_build_no_dist, tag))
+        self.kojihelper.prefetch_latest_builds(package_tag_pairs)
+
     def validate_signatures(self, route: Route, dver: str, build: Build) -> Optional[Reject]:
         """Validate the signatures of the build for the route and dver
 
@@ -349,13 +404,7 @@ class Promoter(object):
         if not signing_keys:  # there are no required keys for this route for this dver
             return None
 
-        route_keyids = {sk.keyid for sk in signing_keys}
-        for sk in signing_keys:
-            # The RPM may have been signed by a subkey of the signing key.
-            # If we have the public key in our keyring, we can ask GPG to
-            # give us the key IDs of the subkeys too.
-            if sk.have_public_key():
-                route_keyids.update(set(sk.query_all_signing_keyids()))
+        route_keyids = self._get_route_keyids(route, dver, signing_keys)
 
         # Check if all the RPMs were already signed by one of the accepted keys.
         bad_rpms = self._validate_route_keyids_vs_rpm_keyids(route_keyids, build_nvr=build.nvr)
@@ -373,6 +422,23 @@ class Promoter(object):
 
             return reject
 
+    def _get_route_keyids(self, route: Route, dver: str, signing_keys: List[SigningKey]) -> Set[str]:
+        """Return the keyids of `signing_keys` (the keys required for the
+        route and dver) and their signing subkeys.  This runs gpg, so the
+        results are remembered for each route and dver.
+
+        """
+        if (route, dver) not in self.route_keyids:
+            route_keyids = {sk.keyid for sk in signing_keys}
+            for sk in signing_keys:
+                # The RPM may have been signed by a subkey of the signing key.
+                # If we have the public key in our keyring, we can ask GPG to
+                # give us the key IDs of the subkeys too.
+                if sk.have_public_key():
+                    route_keyids.update(set(sk.query_all_signing_keyids()))
+            self.route_keyids[(route, dver)] = route_keyids
+        return self.route_keyids[(route, dver)]
+
     # TODO maybe move this to osg_sign.py
     def _validate_route_keyids_vs_rpm_keyids(
             self,
@@ -458,12 +524,12 @@ class Promoter(object):
         pkg_or_build_no_dist = split_repotag_dver(pkg_or_build, self.repotags)[0]
         # Case 1: pkg_or_build is a build, in which case take off its dist tag
         # and put the dist tag specified dist tag on, then find a build for that.
-        build_nvr_1 = self.kojihelper.get_build_in_tag(tag, ".".join([pkg_or_build_no_dist, repotag, dver]))
-        # Case 2: pkg_or_build is a package, in which case putting a dist tag
-        # on doesn't help--just find the latest build in the tag.
-        build_nvr_2 = self.kojihelper.get_build_in_tag(tag, pkg_or_build_no_dist)
-
-        build_nvr = build_nvr_1 or build_nvr_2 or None
+        build_nvr = self.kojihelper.get_build_in_tag(tag, ".".join([pkg_or_build_no_dist, repotag, dver]))
+        if not build_nvr:
+            # Case 2: pkg_or_build is a package, in which case putting a dist tag
+            # on doesn't help--just find the latest build in the tag.
+            # Only looked up if case 1 failed, since this may query koji.
+            build_nvr = self.kojihelper.get_build_in_tag(tag, pkg_or_build_no_dist)
 
         if build_nvr:
             build_obj = Build.new_from_nvr(build_nvr)
@@ -508,25 +574,50 @@ class Promoter(object):
         return dver_build_pairs
 
     def any_distinct_across_dists(self, tag_build_pairs):
-        distinct_nvrs = set()
-        for _, build in tag_build_pairs:
-            distinct_nvrs.add(build.nvr_no_dist)
-        return len(distinct_nvrs) > 1
+        nvrs_no_dist = (build.nvr_no_dist for _, build in tag_build_pairs)
+        first = next(nvrs_no_dist, None)
+        return any(nvr_no_dist != first for nvr_no_dist in nvrs_no_dist)
 
     def _get_valid_tag_for_dver(self, tag_hint, dver):
         """Find tag_hint % dver in koji's list of tags (as queried via
         kojihelper). Return the tag if found; raise KojiTagsAreMessedUp if
-        not.
+        not. Tags that are found are remembered so koji is only searched once
+        per tag.
 
         RouteDiscovery should have already validated the route being used, but
         this is an extra layer of protection to catch mistakes.
 
         """
+        try:
+            return self.valid_tags[(tag_hint, dver)]
+        except KeyError:
+            pass
         tag = tag_hint % dver
-        if not self.kojihelper.get_first_tag('exact', tag):
+        if not self.kojihelper.tag_exists(tag):
             raise KojiTagsAreMessedUp("Can't find tag %s in koji" % tag)
+        self.valid_tags[(tag_hint, dver)] = tag
         return tag
 
+    def split_already_tagged(self):
+        """Split the builds in self.tag_pkg_args into (tag, build) pairs that
+        still need to be tagged and ones that are already in their destination
+        tag.  Returns the two lists.
+
+        """
+        to_tag = []
+        already_tagged = []
+        for tag, builds in self.tag_pkg_args.items():
+            try:
+                builds_in_tag = self.kojihelper.get_tagged_builds(tag)
+            except KeyError:
+                builds_in_tag = frozenset()
+            for build in builds:
+                if build.nvr in builds_in_tag:
+                    already_tagged.append((tag, build))
+                else:
+                    to_tag.append((tag, build))
+        return to_tag, already_tagged
+
     def do_promotions(self, dry_run=False, regen=False):
         """Tag all builds selected to be tagged in self.tag_pkg_args.
         self.tag_pkg_args is a list of (tag, [builds]) pairs.
@@ -541,23 +632,23 @@ class Promoter(object):
 
         """
         printf("--- Tagging builds")
+        kojihelper = self.kojihelper
         tasks = dict()
-        for tag, builds in self.tag_pkg_args.items():
-            for build in builds:
-                try:
-                    # Make sure the build isn't already in tag
-                    if build.nvr in self.kojihelper.get_tagged_builds(tag):
-                        printf("Skipping %s, already in %s", build.nvr, tag)
-                        continue
-                except KeyError:
-                    pass
-
-                # Launch the builds
-                if not dry_run:
-                    task_id = self.kojihelper.tag_build(tag, build.nvr)
-                    tasks[task_id] = (tag, build)
+        to_tag, already_tagged = self.split_already_tagged()
+        for tag, build in already_tagged:
+            printf("Skipping %s, already in %s", build.nvr, tag)
+
+        if dry_run:
+            for tag, build in to_tag:
+                printf("tagBuild('%s', '%s')", tag, build.nvr)
+        elif to_tag:
+            # Launch the builds; the tagBuild calls all go to koji in one request
+            results = kojihelper.tag_builds([(tag, build.nvr) for tag, build in to_tag])
+            for (tag, build), (task_id, error) in zip(to_tag, results):
+                if error:
+                    printf("* Error promoting build %s: %s", build.nvr, error)
                 else:
-                    printf("tagBuild('%s', '%s')", tag, build.nvr)
+                    tasks[task_id] = (tag, build)
 
         promoted_builds = dict(self.tag_pkg_args)
         if not dry_run:
@@ -577,12 +668,12 @@ class Promoter(object):
         containing the build (i.e. NVR as string).
 
         """
-        self.kojihelper.watch_tasks(list(tasks.keys()))
+        kojihelper = self.kojihelper
+        kojihelper.watch_tasks(list(tasks.keys()))
 
-        promoted_builds = {}
+        promoted_builds = collections.defaultdict(list)
         for task_id, (tag, build) in tasks.items():
-            if self.kojihelper.get_task_state(task_id) == 'CLOSED':
-                promoted_builds.setdefault(tag, [])
+            if kojihelper.get_task_state(task_id) == 'CLOSED':
                 promoted_builds[tag].append(build)
             else:
                 printf("* Error promoting build %s", build.nvr)
@@ -604,36 +695,34 @@ def write_jira(kojihelper, promoted_builds, routes, out=None):
     build_tag_table = [[build, tag] for tag in promoted_builds for build in promoted_builds[tag]]
     build_tag_table.sort(key=lambda x: x[0].nvr)
 
-    nvrs_no_dist = set()
-    table_str = "**Build** | **Tag**\n"
-    table_str += "--- | ---\n"
-    for build, tag in build_tag_table:
-        uri = kojihelper.get_build_uri(build.nvr)
-        table_str += " [%s](%s) | %s\n" % (build.nvr, uri, tag)
-        nvrs_no_dist.add(build.nvr_no_dist)
-
+    nvrs_no_dist = set(build.nvr_no_dist for build, _ in build_tag_table)
     out.write("Promoted %s to %s\n" % (
         ", ".join(sorted(nvrs_no_dist)), ", ".join([x.to_tag_hint % "el*" for x in routes])))
-    out.write(table_str)
+
+    uris = kojihelper.get_build_uris([build.nvr for build, _ in build_tag_table])
+    out.write("**Build** | **Tag**\n")
+    out.write("--- | ---\n")
+    for build, tag in build_tag_table:
+        out.write(" [%s](%s) | %s\n" % (build.nvr, uris[build.nvr], tag))
 
 
 #
 # Command line and main
 #
 def format_valid_routes(valid_routes):
-    formatted = ""
+    lines = []
     for route_name in sorted(valid_routes):
         route = valid_routes[route_name]
         dvers_list = comma_join(route.dvers)
         if route.extra_dvers:
             dvers_list += ', [%s]' % comma_join(route.extra_dvers)
-        formatted += " - %-25s: %-31s -> %-31s (%s)\n" % (
+        lines.append(" - %-25s: %-31s -> %-31s (%s)\n" % (
             route_name,
             route.from_tag_hint % '*',
             route.to_tag_hint % '*',
             dvers_list
-        )
-    return formatted
+        ))
+    return "".join(lines)
 
 
 def format_aliases(aliases):
@@ -647,23 +736,27 @@ def format_aliases(aliases):
     )
 
 
-def parse_cmdline_args(configuration, argv):
+def parse_cmdline_args(configuration, argv, interactive=None):
     """
     :param configuration: A Configuration object.
                           We need the routes to build the various dver arguments
                           and the list of routes in the help text.
     :param argv: sys.argv
+    :param interactive: whether stdin is a TTY, which makes --sign the default;
+                        checked here if not given
     :return: the options, the list of route names the user wants to use,
              and the list of packages or builds to promote
     """
-    helpstring = "%prog -r|--route ROUTE... [options] <packages or builds>"
-    helpstring += "\n\nThe following routes exist:\n"
-    helpstring += format_valid_routes(configuration.routes)
+    helpstring_parts = ["%prog -r|--route ROUTE... [options] <packages or builds>",
+                        "\n\nThe following routes exist:\n",
+                        format_valid_routes(configuration.routes)]
     if configuration.aliases:
-        helpstring += "\nThe following aliases to routes exist:\n"
-        helpstring += format_aliases(configuration.aliases)
+        helpstring_parts += ["\nThe following aliases to routes exist:\n",
+                             format_aliases(configuration.aliases)]
+    helpstring = "".join(helpstring_parts)
 
-    all_dvers = configuration.all_dvers
+    # all_dvers is a set; sort it so the options are listed in a stable order
+    all_dvers = sorted(configuration.all_dvers)
 
     parser = OptionParser(helpstring)
 
@@ -684,7 +777,9 @@ def parse_cmdline_args(configuration, argv):
     parser.add_option("--no-sign", dest="try_to_sign", action="store_false",
                       help="Do not attempt to sign packages that don't have the right signature for promotion."
                            "Signing is the default if we have a TTY.")
-    parser.set_default("try_to_sign", sys.stdin.isatty())
+    if interactive is None:
+        interactive = sys.stdin.isatty()
+    parser.set_default("try_to_sign", interactive)
     parser.add_option("--regen", default=False, action="store_true",
                       help="Regenerate repo(s) afterward")
     parser.add_option("-y", "--assume-yes", action="store_true", default=False,
@@ -717,7 +812,13 @@ def parse_cmdline_args(configuration, argv):
 
 
 def starting_match(partial, choices):
-    return [x for x in choices if x.startswith(partial)]
+    """Return the elements of `choices` that start with `partial`.
+    `choices` must be sorted, so the matches are all next to each other.
+    """
+    start = end = bisect.bisect_left(choices, partial)
+    while end < len(choices) and choices[end].startswith(partial):
+        end += 1
+    return choices[start:end]
 
 
 def _get_wanted_routes(configuration, route_args):
@@ -729,8 +830,8 @@ def _get_wanted_routes(configuration, route_args):
 
     # User is allowed to specify the shortest unambiguous prefix of a route
     for arg in expanded_routes:
-        if arg in configuration.all_names:
-            # exact match
+        if arg in configuration.routes or arg in configuration.aliases:
+            # exact match; check the dicts rather than scanning all_names
             matched_routes.update(configuration.matching_route_names(arg))
         else:
             matching_routes = starting_match(arg, configuration.all_names)
@@ -759,7 +860,8 @@ def main(argv=None):
     signing_keys_config = SigningKeysConfig(signing_keys_ini)
     configuration = Configuration([promoter_ini], signing_keys_config)
 
-    options, wanted_routes, pkgs_or_builds = parse_cmdline_args(configuration, argv)
+    interactive = sys.stdin.isatty()
+    options, wanted_routes, pkgs_or_builds = parse_cmdline_args(configuration, argv, interactive)
     if os.path.basename(argv[0]) == "osg-promote":  # HACK. Is there a better way to do this?
         logging.basicConfig(format=f"%(message)s", level=options.loglevel)
     log.setLevel(options.loglevel)
@@ -767,20 +869,27 @@ def main(argv=None):
     route_dvers_pairs = _get_route_dvers_pairs(wanted_routes, valid_routes, options.extra_dvers, options.no_dvers,
                                                options.only_dver)
 
-    kojihelper = KojiHelper(not options.dry_run)
+    # Looking up builds doesn't need authentication; only log in if we're actually going to tag something
+    from .kojiinter import KojiHelper
+    kojihelper = KojiHelper(do_login=False)
 
+    routes = []
+    tags = []  # all source and destination tags
     for route, dvers in route_dvers_pairs:
         printf("Promoting from %s to %s for dvers: %s",
                route.from_tag_hint % 'el*',
                route.to_tag_hint % 'el*',
                comma_join(dvers))
+        routes.append(route)
+        for dver in sorted(dvers):
+            tags += [route.from_tag_hint % dver, route.to_tag_hint % dver]
     printf("Examining the following packages/builds:\n%s", _bulletedlist(pkgs_or_builds))
 
-    dvers = set()
-    for _, x in route_dvers_pairs:
-        dvers.update(x)
     promoter = Promoter(kojihelper, route_dvers_pairs, configuration.signing_keys_by_name,
                         try_to_sign=options.try_to_sign)
+    # Get the builds in all the source and destination tags in one round trip
+    kojihelper.prefetch_tagged_builds(tags)
+    promoter.prefetch_builds(pkgs_or_builds)
     for pkgb in pkgs_or_builds:
         promoter.add_promotion(pkgb,
                                options.ignore_rejects,
@@ -789,8 +898,9 @@ def main(argv=None):
     print()
 
     if promoter.rejects:
-        print("Rejected package or builds:\n%s" % _bulletedlist(promoter.rejects))
-        print("Rejects will not be promoted!")
+        sys.stdout.write("Rejected package or builds:\n")
+        sys.stdout.writelines(" - %s\n" % x for x in sorted(promoter.rejects))
+        sys.stdout.write("Rejects will not be promoted!\n")
         if any(x.reason in (Reject.REASON_DISTINCT_ACROSS_DISTS, Reject.REASON_NOMATCHING_FOR_DIST)
                for x in promoter.rejects):
             print("Rerun with --ignore-rejects to ignore rejections from dver mismatches")
@@ -798,19 +908,23 @@ def main(argv=None):
                for x in promoter.rejects):
             print("Rerun with --ignore-signatures to ignore missing signatures")
 
-    if any(promoter.tag_pkg_args.values()):
-        text_args = {}
-        for tag, builds in promoter.tag_pkg_args.items():
-            text_args[tag] = [x.nvr for x in builds]
+    if promoter.tag_nvr_pairs:
+        text_args = {tag: tuple(x.nvr for x in builds)
+                     for tag, builds in promoter.tag_pkg_args.items()}
         print("Promotion plan:")
         print_table(text_args)
     else:
         printf("Nothing will be promoted!")
         return 1
 
+    # Builds already in their destination tags are skipped by do_promotions(),
+    # so if that's all of them, only a repo regen needs us to be logged in
+    if not options.dry_run and (options.regen or promoter.split_already_tagged()[0]):
+        kojihelper.login_to_koji()
+
     question = "Proceed with promoting the builds?"
     try:
-        proceed = (options.assume_yes or not sys.stdin.isatty() or utils.ask_yn(question))
+        proceed = (options.assume_yes or not interactive or utils.ask_yn(question))
     except KeyboardInterrupt:
         printf("Canceled.")
         return 3
@@ -819,7 +933,7 @@ def main(argv=None):
         promoted_builds = promoter.do_promotions(options.dry_run, options.regen)
         if not options.dry_run:
             printf("\nJIRA code for this set of promotions (new syntax):\n")
-            write_jira(kojihelper, promoted_builds, [x[0] for x in route_dvers_pairs])
+            write_jira(kojihelper, promoted_builds, routes)
     else:
         printf("Not proceeding.")
         return 1
@@ -829,32 +943,32 @@ def main(argv=None):
 
 def _get_route_dvers_pairs(routenames, valid_routes, extra_dvers, no_dvers, only_dver):
     route_dvers_pairs = []
+    bad_routes = False  # report every bad route before exiting, not just the first
 
-    for routename in routenames:
+    for routename in sorted(routenames):
         route = valid_routes[routename]
 
         if only_dver:
-            if only_dver in route.dvers or only_dver in route.extra_dvers:
+            if only_dver in route.supported_dvers:
                 route_dvers_pairs.append((route, set([only_dver])))
             else:
-                printf("The dver %s is not available for route %s.", only_dver, routename)
-                _print_route_dvers(routename, route)
-                sys.exit(2)
+                printf("The dver %s is not available for route %s. Available dver(s): %s",
+                       only_dver, routename, comma_join(sorted(route.supported_dvers)))
+                bad_routes = True
             continue
 
-        wanted_dvers_for_route = set(route.dvers)
-        for extra_dver in extra_dvers:
-            if extra_dver in route.extra_dvers:
-                wanted_dvers_for_route.add(extra_dver)
-        for no_dver in no_dvers:
-            wanted_dvers_for_route.discard(no_dver)
+        wanted_dvers_for_route = (set(route.dvers) | set(route.extra_dvers).intersection(extra_dvers)).difference(no_dvers)
         if not wanted_dvers_for_route:
             printf("All dvers for route %s have been disabled.", routename)
             _print_route_dvers(routename, route)
-            sys.exit(2)
+            bad_routes = True
+            continue
 
         route_dvers_pairs.append((route, wanted_dvers_for_route))
 
+    if bad_routes:
+        sys.exit(2)
+
     return route_dvers_pairs
 
 
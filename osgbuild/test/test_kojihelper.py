@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+"""Tests for the KojiHelper methods that batch their queries with multicall,
+run against a stub koji session instead of a hub"""
+import os
+import sys
+
+import logging
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__) + "/../.."))
+
+import koji as kojilib
+
+from osgbuild import kojiinter
+from osgbuild.error import KojiError
+from osgbuild.kojiinter import KojiHelper, RpmKeyidsPair
+
+log = logging.getLogger('osgbuild.kojiinter')
+log.setLevel(logging.CRITICAL)
+
+
+class StubCall(object):
+    """Stands in for koji's VirtualCall"""
+    def __init__(self, result=None, fault=None):
+        self._result = result
+        self.fault = fault
+
+    @property
+    def result(self):
+        if self.fault is not None:
+            raise self.fault
+        return self._result
+
+
+class StubMultiCall(object):
+    """Stands in for the MultiCallSession returned by ClientSession.multicall()"""
+    def __init__(self, session, strict, batch):
+        self.session = session
+        self.strict = strict
+        self.batch = batch
+        self.calls = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            return
+        self.session.multicalls.append(self)
+        if self.strict:
+            for _, _, call in self.calls:
+                if call.fault is not None:
+                    raise call.fault
+
+    def __getattr__(self, method):
+        def make_call(*args, **kwargs):
+            try:
+                call = StubCall(result=self.session.handlers[method](*args, **kwargs))
+            except kojilib.GenericError as err:
+                call = StubCall(fault=err)
+            self.calls.append((method, args, call))
+            return call
+        return make_call
+
+
+class StubSession(object):
+    """A koji session whose calls, plain or in a multicall, are answered by
+    `handlers`: a dict of functions keyed by method name"""
+    def __init__(self, handlers):
+        self.handlers = handlers
+        self.multicalls = []
+
+    def multicall(self, strict=False, batch=None):
+        return StubMultiCall(self, strict, batch)
+
+    def __getattr__(self, method):
+        # A call made outside of a multicall
+        try:
+            return self.handlers[method]
+        except KeyError:
+            raise AttributeError(method)
+
+
+def _make_kojihelper(handlers):
+    with mock.patch.object(KojiHelper, "read_config_file"), \
+            mock.patch.object(KojiHelper, "init_koji_session"):
+        kojihelper = KojiHelper(do_login=False)
+    kojihelper.kojisession = StubSession(handlers)
+    return kojihelper
+
+
+def _fault(message):
+    raise kojilib.GenericError(message)
+
+
+class TestPrefetchTaggedBuilds(unittest.TestCase):
+    tagged = {
+        "osg-23-main-el9-development": [
+            {"nvr": "foo-1-1.osg23.el9", "name": "foo"},
+            {"nvr": "foo-2-1.osg23.el9", "name": "foo"},
+            {"nvr": "bar-1-1.osg23.el9", "name": "bar"},
+        ],
+        "osg-23-main-el9-testing": [],
+    }
+
+    def _list_tagged(self, tag):
+        if tag not in self.tagged:
+            _fault("No such tag: %s" % tag)
+        return self.tagged[tag]
+
+    def setUp(self):
+        self.kojihelper = _make_kojihelper({"listTagged": self._list_tagged})
+
+    def test_fills_caches(self):
+        self.kojihelper.prefetch_tagged_builds(list(self.tagged))
+        self.assertEqual(frozenset(["foo-1-1.osg23.el9", "foo-2-1.osg23.el9", "bar-1-1.osg23.el9"]),
+                         self.kojihelper.get_tagged_builds("osg-23-main-el9-development"))
+        self.assertEqual(frozenset(["foo", "bar"]),
+                         self.kojihelper.get_tagged_packages("osg-23-main-el9-development"))
+        self.assertEqual(frozenset(), self.kojihelper.get_tagged_builds("osg-23-main-el9-testing"))
+        self.assertEqual(frozenset(), self.kojihelper.get_tagged_packages("osg-23-main-el9-testing"))
+
+    def test_batched(self):
+        tags = ["osg-23-main-el9-development"] * 2 + ["osg-23-main-el9-testing"]
+        self.kojihelper.prefetch_tagged_builds(tags)
+        multicalls = self.kojihelper.kojisession.multicalls
+        self.assertEqual(1, len(multicalls))
+        self.assertEqual(kojiinter.LIST_TAGGED_BATCH_SIZE, multicalls[0].batch)
+        # Duplicates are only listed once
+        self.assertEqual(["osg-23-main-el9-development", "osg-23-main-el9-testing"],
+                         [args[0] for _, args, _ in multicalls[0].calls])
+
+    def test_skips_cached_tags(self):
+        self.kojihelper.prefetch_tagged_builds(["osg-23-main-el9-testing"])
+        self.kojihelper.prefetch_tagged_builds(["osg-23-main-el9-testing"])
+        self.assertEqual(1, len(self.kojihelper.kojisession.multicalls))
+
+    def test_skips_bad_tags(self):
+        self.kojihelper.prefetch_tagged_builds(["no-such-tag", "osg-23-main-el9-testing"])
+        self.assertNotIn("no-such-tag", self.kojihelper.tagged_builds_cache)
+        self.assertIn("osg-23-main-el9-testing", self.kojihelper.tagged_builds_cache)
+
+
+class TestPrefetchLatestBuilds(unittest.TestCase):
+    latest = {
+        ("foo", "osg-23-main-el9-development"): [{"nvr": "foo-2-1.osg23.el9", "name": "foo"}],
+        ("foo", "osg-23-main-el9-testing"): [],
+    }
+
+    def _list_tagged(self, tag, latest=False, package=None):
+        self.assertTrue(latest)
+        if tag == "no-such-tag":
+            _fault("No such tag: %s" % tag)
+        return self.latest[(package, tag)]
+
+    def setUp(self):
+        self.kojihelper = _make_kojihelper({"listTagged": self._list_tagged})
+
+    def test_fills_cache(self):
+        self.kojihelper.prefetch_latest_builds(list(self.latest) + [("foo", "no-such-tag")])
+        multicalls = self.kojihelper.kojisession.multicalls
+        self.assertEqual(1, len(multicalls))
+        self.assertEqual(kojiinter.MULTICALL_BATCH_SIZE, multicalls[0].batch)
+        self.assertEqual({
+            ("foo", "osg-23-main-el9-development"): "foo-2-1.osg23.el9",
+            # An empty result means there is no build, and that is cached too
+            ("foo", "osg-23-main-el9-testing"): None,
+        }, self.kojihelper.latest_builds_cache)
+
+        # get_latest_build() is answered from the cache, including for None
+        self.assertEqual("foo-2-1.osg23.el9",
+                         self.kojihelper.get_latest_build("foo", "osg-23-main-el9-development"))
+        self.assertIsNone(self.kojihelper.get_latest_build("foo", "osg-23-main-el9-testing"))
+
+    def test_skips_cached_pairs(self):
+        self.kojihelper.prefetch_latest_builds(list(self.latest))
+        self.kojihelper.prefetch_latest_builds(list(self.latest))
+        self.assertEqual(1, len(self.kojihelper.kojisession.multicalls))
+
+
+class TestGetBuilds(unittest.TestCase):
+    builds = {
+        "foo-1-1.osg23.el9": {"id": 1, "build_id": 1, "nvr": "foo-1-1.osg23.el9"},
+        "bar-1-1.osg23.el9": {"id": 2, "build_id": 2, "nvr": "bar-1-1.osg23.el9"},
+    }
+    rpms = {
+        1: [{"id": 11, "name": "foo", "version": "1", "release": "1.osg23.el9", "arch": "x86_64"},
+            {"id": 12, "name": "foo", "version": "1", "release": "1.osg23.el9", "arch": "src"}],
+    }
+    sigs = {
+        11: [{"sigkey": "12baacc9"}, {"sigkey": ""}],
+        12: [],
+    }
+
+    def _get_build(self, nvr):
+        if nvr == "bad-build":
+            _fault("Invalid NVR")
+        return self.builds.get(nvr)
+
+    def setUp(self):
+        self.kojihelper = _make_kojihelper({
+            "getBuild": self._get_build,
+            "listRPMs": lambda buildID: self.rpms.get(buildID, []),
+            "queryRPMSigs": lambda rpm_id: self.sigs[rpm_id],
+        })
+
+    def test_koji_get_builds(self):
+        nvrs = ["bar-1-1.osg23.el9", "foo-1-1.osg23.el9", "bar-1-1.osg23.el9", "missing-1-1"]
+        self.assertEqual([self.builds["bar-1-1.osg23.el9"], self.builds["foo-1-1.osg23.el9"],
+                          self.builds["bar-1-1.osg23.el9"], None],
+                         self.kojihelper.koji_get_builds(nvrs))
+        multicalls = self.kojihelper.kojisession.multicalls
+        self.assertEqual(1, len(multicalls))
+        self.assertEqual(kojiinter.MULTICALL_BATCH_SIZE, multicalls[0].batch)
+        self.assertEqual(3, len(multicalls[0].calls))
+
+        # Everything is cached now
+        self.kojihelper.koji_get_builds(nvrs)
+        self.assertEqual(1, len(multicalls))
+
+    def test_koji_get_builds_fault(self):
+        self.assertRaises(KojiError, self.kojihelper.koji_get_builds, ["foo-1-1.osg23.el9", "bad-build"])
+
+    def test_get_rpms_and_keyids_in_build(self):
+        self.assertEqual([RpmKeyidsPair("foo-1-1.osg23.el9.x86_64.rpm", {"12baacc9"}),
+                          RpmKeyidsPair("foo-1-1.osg23.el9.src.rpm", set())],
+                         self.kojihelper.get_rpms_and_keyids_in_build("foo-1-1.osg23.el9"))
+        multicalls = self.kojihelper.kojisession.multicalls
+        self.assertEqual(1, len(multicalls))
+        self.assertEqual(kojiinter.MULTICALL_BATCH_SIZE, multicalls[0].batch)
+        self.assertEqual([(11,), (12,)], [args for _, args, _ in multicalls[0].calls])
+
+    def test_get_rpms_and_keyids_in_empty_build(self):
+        self.assertEqual([], self.kojihelper.get_rpms_and_keyids_in_build("bar-1-1.osg23.el9"))
+        self.assertEqual([], self.kojihelper.get_rpms_and_keyids_in_build("missing-1-1"))
+        self.assertEqual([], self.kojihelper.kojisession.multicalls)
+
+
+class TestTagBuilds(unittest.TestCase):
+
+    @staticmethod
+    def _tag_build(tag, build):
+        if build == "bad-1-1.osg23.el9":
+            _fault("Build bad-1-1.osg23.el9 is locked")
+        return 100 + int(build.split("-")[1])
+
+    def setUp(self):
+        self.kojihelper = _make_kojihelper({"tagBuild": self._tag_build})
+
+    def test_tag_builds(self):
+        pairs = [("osg-23-main-el9-testing", "foo-1-1.osg23.el9"),
+                 ("osg-23-main-el9-testing", "bad-1-1.osg23.el9"),
+                 ("osg-23-main-el8-testing", "foo-2-1.osg23.el8")]
+        self.kojihelper.tagged_builds_cache["osg-23-main-el9-testing"] = frozenset()
+        self.assertEqual([(101, None), (None, "Build bad-1-1.osg23.el9 is locked"), (102, None)],
+                         self.kojihelper.tag_builds(pairs))
+        multicalls = self.kojihelper.kojisession.multicalls
+        self.assertEqual(1, len(multicalls))
+        self.assertEqual(kojiinter.MULTICALL_BATCH_SIZE, multicalls[0].batch)
+        # The destination tags have changed, so they aren't cached anymore
+        self.assertNotIn("osg-23-main-el9-testing", self.kojihelper.tagged_builds_cache)
+
+    def test_tag_builds_server_error(self):
+        with mock.patch.object(StubSession, "multicall", side_effect=kojilib.ServerOffline("down")):
+            self.assertRaises(KojiError, self.kojihelper.tag_builds,
+                              [("osg-23-main-el9-testing", "foo-1-1.osg23.el9")])
+
+
+if __name__ == '__main__':
+    unittest.main()
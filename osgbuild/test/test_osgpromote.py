@@ -3,8 +3,11 @@ import os
 import sys
 
 import logging
+import re
 import unittest
+from contextlib import redirect_stdout
 from io import StringIO
+from unittest import mock
 
 import osgbuild.kojiinter
 
@@ -296,6 +299,7 @@ class FakeKojiHelper(osgbuild.kojiinter.KojiHelper):
     }
 
     want_success = True
+    refused_builds = frozenset()  # builds that tagBuild fails on
 
     def __init__(self, *args):
         self.tagged_packages_by_tag = {}
@@ -304,6 +308,7 @@ class FakeKojiHelper(osgbuild.kojiinter.KojiHelper):
             names = sorted(set([osgbuild.utils.split_nvr(x)[0] for x in nvrs]))
             self.tagged_packages_by_tag[k] = names
         self.newly_tagged_packages = []
+        self.logins = 0
         super(FakeKojiHelper, self).__init__(*args)
 
     def get_first_tag(self, match, terms):
@@ -326,6 +331,9 @@ class FakeKojiHelper(osgbuild.kojiinter.KojiHelper):
     def koji_get_build(self, build_nvr):
         return {'id': 319}
 
+    def koji_get_builds(self, build_nvrs):
+        return [self.koji_get_build(x) for x in build_nvrs]
+
     def get_rpms_and_keyids_in_build(self, build_nvr):
         return self.rpms_and_keyids_by_nvr.get(build_nvr, [])
 
@@ -335,6 +343,24 @@ class FakeKojiHelper(osgbuild.kojiinter.KojiHelper):
         # sys.stdout.write("%d = tag(%s, %s)\n" % (task_id, tag, build))
         return task_id
 
+    def tag_builds(self, tag_build_pairs):
+        results = []
+        for tag, build in tag_build_pairs:
+            if build in self.refused_builds:
+                results.append((None, "Build %s is locked" % build))
+            else:
+                results.append((self.tag_build(tag, build), None))
+        return results
+
+    def prefetch_tagged_builds(self, tags):
+        pass  # everything is in tagged_builds_by_tag already
+
+    def prefetch_latest_builds(self, package_tag_pairs):
+        pass
+
+    def login_to_koji(self):
+        self.logins += 1
+
     def watch_tasks(self, a_list):
         pass
 
@@ -351,6 +377,35 @@ class TestUtil(unittest.TestCase):
     def test_split_nvr(self):
         self.assertEqual(('osg-build', '1.3.2', '1.osg23.el9'), osgbuild.utils.split_nvr(self.buildnvr))
 
+    @staticmethod
+    def _old_split_repotag_dver(build, known_repotags=None):
+        """The regex-based split_repotag_dver() that the current one replaced"""
+        build_no_dist, repotag, dver = build, "", ""
+        build_no_dist_pat = r"(?P<build_no_dist>.+)"
+        repotag_pat = r"(?P<repotag>[a-z]\w+)"
+        dver_pat = r"(?P<dver>el\d+)"
+        if known_repotags is not None:
+            repotag_pat = r"(?P<repotag>" + "|".join(known_repotags) + ")"
+        match = (re.match(build_no_dist_pat + r"\." + repotag_pat + r"\." + dver_pat + "$", build) or
+                 re.match(build_no_dist_pat + r"\." + dver_pat + "$", build) or
+                 re.match(build_no_dist_pat + r"\." + repotag_pat + "$", build))
+        if match:
+            groupdict = match.groupdict()
+            build_no_dist, repotag, dver = groupdict['build_no_dist'], groupdict.get('repotag', ''), groupdict.get('dver', '')
+        return build_no_dist, repotag, dver
+
+    def test_split_repotag_dver_matches_old_regex(self):
+        builds = ["foo-1-1", "foo-1-1.osg23.el9", "foo-1-1.el9", "foo-1-1.osg23", "foo-1-1.osg_up.el9",
+                  "foo-1-1.a_", "foo-1-1.a_.el9", "foo-1-1.a", "foo-1-1.a.el9", "foo-1-1.A1.el9", "foo-1-1.1a.el9",
+                  "foo-1-1.osg-23.el9", "foo-1-1.el", "foo-1-1.elx", "foo-1-1.el9.el8", "foo-1-1.11",
+                  "foo-1-1.", "foo-1-1..", "foo-1-1.el9.", "foo-1-1.osg23.", "foo-1-1..el9", "foo-1-1.osg23..el9",
+                  ".el9", ".osg23.el9", "el9", ".", "", "foo-1-1.osg23up.el8", "foo-1-1.osg36.el7"]
+        for known_repotags in [None, [], ["osg23", "osg23up"], ["osg_up", "a_"]]:
+            for build in builds:
+                self.assertEqual(self._old_split_repotag_dver(build, known_repotags),
+                                 promoter.split_repotag_dver(build, known_repotags),
+                                 "build=%r known_repotags=%r" % (build, known_repotags))
+
     def test_split_repotag_dver(self):
         self.assertEqual(('osg-build-1.3.2-1', 'osg23', 'el9'), promoter.split_repotag_dver(self.buildnvr))
         self.assertEqual(('foo-1-1', 'osg', ''), promoter.split_repotag_dver('foo-1-1.osg'))
@@ -411,6 +466,24 @@ class TestRouteLoader(unittest.TestCase):
             self.assertIsInstance(route, promoter.Route)
 
 
+class TestParseCmdlineArgs(unittest.TestCase):
+    def setUp(self):
+        self.configuration = _config()
+
+    def _try_to_sign(self, args, interactive):
+        options, _, _ = promoter.parse_cmdline_args(self.configuration, ["osg-promote", "-r", "23-main"] + args,
+                                                    interactive)
+        return options.try_to_sign
+
+    def test_sign_default_follows_tty(self):
+        self.assertIs(True, self._try_to_sign(["goodpkg"], interactive=True))
+        self.assertIs(False, self._try_to_sign(["goodpkg"], interactive=False))
+
+    def test_sign_options(self):
+        self.assertIs(False, self._try_to_sign(["--no-sign", "goodpkg"], interactive=True))
+        self.assertIs(True, self._try_to_sign(["--sign", "goodpkg"], interactive=False))
+
+
 class TestPromoter(unittest.TestCase):
 
     def setUp(self):
@@ -460,6 +533,14 @@ class TestPromoter(unittest.TestCase):
                 'goodpkg-2000-1.osg36.%s' % dver,
                 [x.nvr for x in self.promoter_36testing.tag_pkg_args[self.route_36testing.to_tag_hint % dver]])
 
+    def test_add_promotion_twice(self):
+        self.promoter_36testing.add_promotion('goodpkg', ignore_signatures=True)
+        self.promoter_36testing.add_promotion('goodpkg-2000-1', ignore_signatures=True)
+        for dver in self.route_36testing.dvers:
+            self.assertEqual(
+                ['goodpkg-2000-1.osg36.%s' % dver],
+                self._tagged_nvrs(self.promoter_36testing, self.route_36testing, dver))
+
     def test_add_promotion_with_signature_check(self):
         build_base = 'goodpkg-2000-1'
         for route, prom in [(self.route_36upcoming, self.promoter_36upcoming),
@@ -541,6 +622,18 @@ class TestPromoter(unittest.TestCase):
             self.assertEqual(1, len(promoted_builds[tag]))
         self.assertEqual(3, len(promoted_builds))
 
+    def test_do_promotions_refused(self):
+        self.kojihelper.refused_builds = frozenset(['goodpkg-2000-1.osg36.el8'])
+        self.promoter_36testing.add_promotion('goodpkg', ignore_signatures=True)
+        out = StringIO()
+        with redirect_stdout(out):
+            promoted_builds = self.promoter_36testing.do_promotions()
+        self.assertIn("* Error promoting build goodpkg-2000-1.osg36.el8: Build goodpkg-2000-1.osg36.el8 is locked",
+                      out.getvalue())
+        self.assertEqual(2, len(self.kojihelper.newly_tagged_packages))
+        self.assertNotIn('osg-3.6-el8-testing', promoted_builds)
+        self.assertEqual(2, len(promoted_builds))
+
     def test_do_multi_promotions(self):
         prom = self._make_promoter(self.multi_routes,
                                    dvers=self.route_23main.dvers)
@@ -605,5 +698,58 @@ class TestPromoter(unittest.TestCase):
         self._test_write_jira(real_promotions=True)
 
 
+class TestMain(unittest.TestCase):
+    """Run main() end to end, with FakeKojiHelper standing in for koji"""
+
+    def setUp(self):
+        self.kojihelper = FakeKojiHelper(False)
+        patches = [
+            mock.patch("osgbuild.kojiinter.KojiHelper", return_value=self.kojihelper),
+            mock.patch.object(promoter.sys.stdin, "isatty", return_value=False),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def _main(self, *args):
+        out = StringIO()
+        with redirect_stdout(out):
+            ret = promoter.main(["test-osg-promote", "-r", "3.6-testing", "--ignore-signatures"] + list(args))
+        return ret, out.getvalue()
+
+    def test_promote(self):
+        ret, _ = self._main("goodpkg")
+        self.assertEqual(0, ret)
+        self.assertEqual(1, self.kojihelper.logins)
+        self.assertEqual(['goodpkg-2000-1.osg36.%s' % dver for dver in ['el7', 'el8', 'el9']],
+                         sorted(self.kojihelper.newly_tagged_packages))
+
+    def test_dry_run(self):
+        ret, out = self._main("--dry-run", "goodpkg")
+        self.assertEqual(0, ret)
+        self.assertEqual(0, self.kojihelper.logins)
+        self.assertEqual([], self.kojihelper.newly_tagged_packages)
+        self.assertIn("tagBuild('osg-3.6-el9-testing', 'goodpkg-2000-1.osg36.el9')", out)
+
+    def test_nothing_to_promote(self):
+        ret, out = self._main("no-such-package")
+        self.assertEqual(1, ret)
+        self.assertIn("Nothing will be promoted!", out)
+        self.assertEqual(0, self.kojihelper.logins)
+
+    def test_already_tagged(self):
+        tagged_builds_by_tag = dict(self.kojihelper.tagged_builds_by_tag)
+        for dver in ['el7', 'el8', 'el9']:
+            tagged_builds_by_tag['osg-3.6-%s-testing' % dver] = [
+                {'nvr': 'goodpkg-2000-1.osg36.%s' % dver, 'latest': True}]
+        self.kojihelper.tagged_builds_by_tag = tagged_builds_by_tag
+        ret, out = self._main("goodpkg")
+        self.assertEqual(0, ret)
+        # Nothing needs tagging, so there was no reason to log in
+        self.assertEqual(0, self.kojihelper.logins)
+        self.assertEqual([], self.kojihelper.newly_tagged_packages)
+        self.assertIn("Skipping goodpkg-2000-1.osg36.el9, already in osg-3.6-el9-testing", out)
+
+
 if __name__ == '__main__':
     unittest.main()
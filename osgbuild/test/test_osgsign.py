@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+import os
+import sys
+
+import errno
+import logging
+import shutil
+import subprocess
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__) + "/../.."))
+
+from osgbuild import osg_sign
+from osgbuild.kojiinter import RpmKeyidsPair
+
+log = logging.getLogger('osgbuild.osg_sign')
+log.setLevel(logging.ERROR)
+
+
+KEYID = "12baacc9"
+OTHER_KEYID = "96d2b90f"
+
+
+def _make_signing_key():
+    signing_key = osg_sign.SigningKey("test", KEYID, ["el9"], digest_algo=None)
+    # Pretend we already asked gpg, so the tests don't need it
+    signing_key.all_signing_keyids = [KEYID]
+    return signing_key
+
+
+class FakeKojiHelper(object):
+    """Just enough of KojiHelper for sign_and_import_build_batch()"""
+    def __init__(self, rpms_and_keyids_by_nvr):
+        self.rpms_and_keyids_by_nvr = rpms_and_keyids_by_nvr
+
+    def get_rpms_and_keyids_in_build(self, build_nvr):
+        return self.rpms_and_keyids_by_nvr[build_nvr]
+
+
+def _fake_download_build(cmd, cwd=None):
+    """Stand-in for utils.checked_call() running `osg-koji download-build`:
+    create an empty RPM file for the build in `cwd`."""
+    build_nvr = cmd[-1]
+    with open(os.path.join(cwd, build_nvr + ".x86_64.rpm"), "w"):
+        pass
+
+
+class TestSignAndImport(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.signing_key = _make_signing_key()
+        self.kojihelper = FakeKojiHelper({
+            "unsigned-1-1.el9": [RpmKeyidsPair("unsigned-1-1.el9.x86_64.rpm", {OTHER_KEYID})],
+            "other-1-1.el9": [RpmKeyidsPair("other-1-1.el9.x86_64.rpm", set())],
+            "signed-1-1.el9": [RpmKeyidsPair("signed-1-1.el9.x86_64.rpm", {KEYID})],
+        })
+        patches = [
+            mock.patch.dict(os.environ, {"TMPDIR": self.tempdir}),
+            mock.patch.object(osg_sign.utils, "checked_call", side_effect=_fake_download_build),
+            mock.patch.object(osg_sign, "sign_rpms"),
+            mock.patch.object(osg_sign, "import_signatures"),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir, ignore_errors=True)
+
+    def test_batch_uses_one_subdir_per_build(self):
+        osg_sign.sign_and_import_build_batch(["unsigned-1-1.el9", "other-1-1.el9"],
+                                             self.signing_key, self.kojihelper)
+        download_cwds = [call[1]["cwd"] for call in osg_sign.utils.checked_call.call_args_list]
+        self.assertEqual(["unsigned-1-1.el9", "other-1-1.el9"], [os.path.basename(x) for x in download_cwds])
+        self.assertEqual(1, len(set(os.path.dirname(x) for x in download_cwds)))
+
+        # All RPMs are signed with a single call
+        osg_sign.sign_rpms.assert_called_once()
+        signed_rpms = osg_sign.sign_rpms.call_args[0][1]
+        self.assertEqual(2, len(signed_rpms))
+
+        # Signatures are imported relative to the shared work directory
+        osg_sign.import_signatures.assert_called_once()
+        imported, kwargs = osg_sign.import_signatures.call_args
+        self.assertEqual(["unsigned-1-1.el9/unsigned-1-1.el9.x86_64.rpm",
+                          "other-1-1.el9/other-1-1.el9.x86_64.rpm"], imported[0])
+        self.assertEqual(os.path.dirname(download_cwds[0]), kwargs["cwd"])
+
+    def test_already_signed_build_is_not_downloaded(self):
+        osg_sign.sign_and_import_build_batch(["signed-1-1.el9", "unsigned-1-1.el9"],
+                                             self.signing_key, self.kojihelper)
+        downloaded = [call[0][0][-1] for call in osg_sign.utils.checked_call.call_args_list]
+        self.assertEqual(["unsigned-1-1.el9"], downloaded)
+
+    def test_nothing_to_do(self):
+        osg_sign.sign_and_import_build_batch(["signed-1-1.el9"], self.signing_key, self.kojihelper)
+        osg_sign.utils.checked_call.assert_not_called()
+        osg_sign.sign_rpms.assert_not_called()
+        osg_sign.import_signatures.assert_not_called()
+
+    def test_already_signed_build_is_downloaded_for_results(self):
+        results_dir = os.path.join(self.tempdir, "results")
+        osg_sign.sign_and_import_build_batch(["signed-1-1.el9"], self.signing_key, self.kojihelper,
+                                             results_dir=results_dir)
+        self.assertEqual(["signed-1-1.el9.x86_64.rpm"], os.listdir(results_dir))
+        osg_sign.import_signatures.assert_not_called()
+
+    def test_one_job_signs_in_sequential_batches(self):
+        builds = ["pkg%d-1-1.el9" % i for i in range(3 * osg_sign.SIGN_BATCH_SIZE)]
+        bad_build = builds[osg_sign.SIGN_BATCH_SIZE]  # in the second batch
+
+        def fake_batch(batch, *args, **kwargs):
+            if bad_build in batch:
+                raise osg_sign.SigningError("failed")
+
+        with mock.patch("osgbuild.kojiinter.KojiHelper") as kojihelper_class, \
+                mock.patch.object(osg_sign, "sign_and_import_build_batch", side_effect=fake_batch) as batch_fn:
+            self.assertRaises(osg_sign.SigningError, osg_sign.sign_and_import_builds,
+                              builds, self.signing_key, do_login=False, jobs=1)
+        # Builds are signed a batch at a time, and the first failure stops the run
+        batches = [call[0][0] for call in batch_fn.call_args_list]
+        self.assertEqual([builds[:osg_sign.SIGN_BATCH_SIZE], builds[osg_sign.SIGN_BATCH_SIZE:2 * osg_sign.SIGN_BATCH_SIZE]],
+                         batches)
+        self.assertEqual(1, kojihelper_class.call_count)
+
+    def test_parallel_batches_are_capped(self):
+        builds = ["pkg%d-1-1.el9" % i for i in range(2 * osg_sign.SIGN_BATCH_SIZE + 1)]
+        with mock.patch("osgbuild.kojiinter.KojiHelper"), \
+                mock.patch.object(osg_sign, "sign_and_import_build_batch") as batch_fn:
+            osg_sign.sign_and_import_builds(builds, self.signing_key, do_login=False, jobs=2)
+        batches = [call[0][0] for call in batch_fn.call_args_list]
+        self.assertEqual(3, len(batches))
+        self.assertTrue(all(len(batch) <= osg_sign.SIGN_BATCH_SIZE for batch in batches))
+        self.assertEqual(sorted(builds), sorted(sum(batches, [])))
+
+    def test_parallel_failures_are_aggregated(self):
+        builds = ["pkg%d-1-1.el9" % i for i in range(3 * osg_sign.SIGN_BATCH_SIZE)]
+        bad_builds = {builds[0], builds[-1]}  # one in the first batch, one in the last
+
+        def fake_batch(batch, *args, **kwargs):
+            if bad_builds.intersection(batch):
+                raise osg_sign.SigningError("failed")
+
+        with mock.patch("osgbuild.kojiinter.KojiHelper") as kojihelper_class, \
+                mock.patch.object(osg_sign, "sign_and_import_build_batch", side_effect=fake_batch) as batch_fn:
+            with self.assertRaises(osg_sign.SigningError) as context:
+                osg_sign.sign_and_import_builds(builds, self.signing_key, do_login=True, jobs=2)
+        # Every batch ran, even after a failure
+        self.assertEqual(3, batch_fn.call_count)
+        message = str(context.exception)
+        self.assertIn("%d build(s)" % (2 * osg_sign.SIGN_BATCH_SIZE), message)
+        for build in builds[:osg_sign.SIGN_BATCH_SIZE] + builds[-osg_sign.SIGN_BATCH_SIZE:]:
+            self.assertIn(build, message)
+        for build in builds[osg_sign.SIGN_BATCH_SIZE:-osg_sign.SIGN_BATCH_SIZE]:
+            self.assertNotIn(build, message)
+        # Sessions are per worker thread, not per batch
+        self.assertLessEqual(kojihelper_class.call_count, 2)
+
+
+class TestQueryAllSigningKeyids(unittest.TestCase):
+
+    def test_failure_is_cached(self):
+        signing_key = osg_sign.SigningKey("test", KEYID, ["el9"], digest_algo=None)
+        failed = subprocess.CompletedProcess(["gpg"], 2, stdout=b"", stderr=b"gpg: error")
+        with mock.patch.object(osg_sign.subprocess, "run", return_value=failed) as run:
+            self.assertEqual([], signing_key.query_all_signing_keyids())
+            self.assertEqual([], signing_key.query_all_signing_keyids())
+        self.assertEqual(1, run.call_count)
+
+    def test_result_is_cached(self):
+        signing_key = osg_sign.SigningKey("test", KEYID, ["el9"], digest_algo=None)
+        output = (b"pub:u:4096:1:0123456789ABCDEF:1:::u:::scSC::::::23::0:\n"
+                  b"sub:u:4096:1:FEDCBA98%s:1::::::e::::::23:\n"
+                  b"sub:u:4096:1:00000000%s:1::::::s::::::23:\n" % (b"76543210", KEYID.upper().encode()))
+        ok = subprocess.CompletedProcess(["gpg"], 0, stdout=output, stderr=b"")
+        with mock.patch.object(osg_sign.subprocess, "run", return_value=ok) as run:
+            self.assertEqual(["89abcdef", KEYID], signing_key.query_all_signing_keyids())
+            signing_key.query_all_signing_keyids()
+        self.assertEqual(1, run.call_count)
+
+
+class TestImportSignatures(unittest.TestCase):
+
+    @staticmethod
+    def _rpms(count):
+        return ["pkg%d.rpm" % i for i in range(count)]
+
+    def _chunks(self, rpms, **kwargs):
+        with mock.patch.object(osg_sign.subprocess, "run") as run:
+            osg_sign.import_signatures(rpms, **kwargs)
+        for call in run.call_args_list:
+            self.assertEqual(["osg-koji", "import-sig"], call[0][0][:2])
+        return [call[0][0][2:] for call in run.call_args_list]
+
+    def test_exactly_one_chunk(self):
+        rpms = self._rpms(osg_sign.IMPORT_SIG_CHUNK_SIZE)
+        self.assertEqual([rpms], self._chunks(rpms))
+
+    def test_one_more_than_a_chunk(self):
+        rpms = self._rpms(osg_sign.IMPORT_SIG_CHUNK_SIZE + 1)
+        self.assertEqual([rpms[:-1], rpms[-1:]], self._chunks(rpms))
+
+    def test_custom_chunk_size(self):
+        rpms = self._rpms(5)
+        self.assertEqual([rpms[0:2], rpms[2:4], rpms[4:5]], self._chunks(rpms, chunk_size=2))
+
+    def test_no_rpms(self):
+        self.assertEqual([], self._chunks([]))
+
+    def test_cwd(self):
+        with mock.patch.object(osg_sign.subprocess, "run") as run:
+            osg_sign.import_signatures(self._rpms(3), cwd="/some/workdir", chunk_size=2)
+        self.assertEqual(["/some/workdir"] * 2, [call[1]["cwd"] for call in run.call_args_list])
+
+    def test_failure_stops_import(self):
+        error = subprocess.CalledProcessError(1, ["osg-koji", "import-sig"])
+        with mock.patch.object(osg_sign.subprocess, "run", side_effect=[None, error, None]) as run:
+            self.assertRaises(osg_sign.SigningError, osg_sign.import_signatures, self._rpms(5), chunk_size=2)
+        self.assertEqual(2, run.call_count)
+
+
+class TestLinkOrCopy(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.src = os.path.join(self.tempdir, "src.rpm")
+        self.dst = os.path.join(self.tempdir, "dst.rpm")
+        with open(self.src, "w") as fh:
+            fh.write("new")
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir, ignore_errors=True)
+
+    def _read_dst(self):
+        with open(self.dst) as fh:
+            return fh.read()
+
+    def test_link(self):
+        osg_sign._link_or_copy(self.src, self.dst)
+        self.assertTrue(os.path.samefile(self.src, self.dst))
+
+    def test_replaces_existing(self):
+        with open(self.dst, "w") as fh:
+            fh.write("old")
+        osg_sign._link_or_copy(self.src, self.dst)
+        self.assertEqual("new", self._read_dst())
+
+    def _test_copy_fallback(self, err_no):
+        with mock.patch.object(osg_sign.os, "link", side_effect=OSError(err_no, os.strerror(err_no))):
+            osg_sign._link_or_copy(self.src, self.dst)
+        self.assertEqual("new", self._read_dst())
+        self.assertFalse(os.path.samefile(self.src, self.dst))
+
+    def test_copy_across_filesystems(self):
+        self._test_copy_fallback(errno.EXDEV)
+
+    def test_copy_if_links_not_allowed(self):
+        self._test_copy_fallback(errno.EPERM)
+
+    def test_other_errors_raised(self):
+        with mock.patch.object(osg_sign.os, "link", side_effect=OSError(errno.ENOSPC, "No space")):
+            self.assertRaises(OSError, osg_sign._link_or_copy, self.src, self.dst)
+
+
+if __name__ == '__main__':
+    unittest.main()
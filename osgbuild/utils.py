@@ -2,6 +2,7 @@
 import configparser
 import contextlib
 import errno
+import functools
 from itertools import zip_longest
 import logging
 import os
@@ -11,7 +12,7 @@ import shutil
 import subprocess
 import sys
 import tempfile
-from typing import Any, AnyStr, Dict, Iterable, List, Union
+from typing import Any, AnyStr, Dict, Iterable, List, Sequence, Union
 from datetime import datetime
 
 from . import constants
@@ -252,21 +253,25 @@ def unslurp(filename, contents):
 
 
 def atomic_unslurp(filename, contents, mode=0o644):
-    """Write contents to a file, making sure a half-written file is never
-    left behind in case of error.
+    """Write contents (str or bytes) to a file, making sure a half-written
+    file is never left behind in case of error.  The contents go to a
+    temporary file in the same directory which then replaces `filename` in a
+    single rename, already having its final permissions.
 
     """
+    if isinstance(contents, str):
+        contents = contents.encode()
     fd, tempname = tempfile.mkstemp(dir=os.path.dirname(filename))
     try:
-        try:
-            os.write(fd, contents)
-        finally:
-            os.close(fd)
+        with os.fdopen(fd, "wb") as fh:
+            fh.write(contents)
+            fh.flush()
+            os.fchmod(fh.fileno(), mode)
+            os.fsync(fh.fileno())
+        os.replace(tempname, filename)
     except EnvironmentError:
         os.unlink(tempname)
         raise
-    os.rename(tempname, filename)
-    os.chmod(filename, mode)
 
 
 def find_file(filename, paths=None, strict=False):
@@ -452,11 +457,9 @@ def get_screen_columns():
     # type: () -> int
     """Return the number of columns in the screen"""
     default = 80
-    try:
-        columns = int(os.environ.get('COLUMNS', backtick("stty size").split()[1]))
-        if columns < 10:
-            columns = default
-    except (TypeError, OSError):
+    # Uses $COLUMNS if set, then asks the terminal directly (no `stty` subprocess)
+    columns = shutil.get_terminal_size((default, 24)).columns
+    if columns < 10:
         columns = default
     return columns
 
@@ -471,7 +474,7 @@ def print_line(file=None):
     print("-" * (get_screen_columns() - 1), file=file)
 
 
-def print_table(columns_by_header: Dict[str, List[str]]):
+def print_table(columns_by_header: Dict[str, Sequence[str]]):
     """ Print a dict of lists in a table, with each list being a column.
     If the columns are too wide to fit on one row, the table will be split up
     into multiple sub-tables, printed individually.
@@ -483,7 +486,7 @@ def print_table(columns_by_header: Dict[str, List[str]]):
     columns: List[List[str]] = []
     column_widths = []
     for header in sorted(columns_by_header):
-        column_width = max(len(header), *[len(col) for col in columns_by_header[header]])
+        column_width = max(len(header), max(map(len, columns_by_header[header]), default=0))
         columns.append([header, '-' * column_width] + sorted(columns_by_header[header]))
         column_widths.append(column_width)
 
@@ -518,12 +521,12 @@ def print_table(columns_by_header: Dict[str, List[str]]):
 
 def _print_subtable(subtable_columns: List[List[str]], field_widths: List[int]):
     """ Print a single sub-table. subtable_columns and field_widths are parallel lists. """
-    column_padding = 2
+    padding = ' ' * 2
+    # Build the whole sub-table and write it at once instead of one write per cell
+    lines = []
     for row in zip_longest(fillvalue='', *subtable_columns):
-        for idx, item in enumerate(row):
-            field_width = field_widths[idx]
-            printf("%-*s", field_width, item, end=' ' * column_padding)
-        print("")
+        lines.append("".join("%-*s%s" % (field_widths[idx], item, padding) for idx, item in enumerate(row)) + "\n")
+    sys.stdout.write("".join(lines))
 
 
 def is_url(location):
@@ -617,10 +620,12 @@ def chdir(directory):
     os.chdir(olddir)
 
 
+@functools.lru_cache(maxsize=4096)
 def split_nvr(build):
     """Split an NVR into a (Name, Version, Release) tuple"""
-    match = re.match(r"(?P<name>.+)-(?P<version>[^-]+)-(?P<release>[^-]+)$", build)
-    if match:
-        return match.group('name'), match.group('version'), match.group('release')
+    # Version and release can't contain '-', so they're the last two fields
+    parts = build.rsplit('-', 2)
+    if len(parts) == 3 and all(parts):
+        return parts[0], parts[1], parts[2]
     else:
         return '', '', ''